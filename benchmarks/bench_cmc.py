@@ -0,0 +1,123 @@
+"""
+Benchmark of the live camera motion compensation methods.
+
+Renders a synthetic sequence by warping a textured background with a known
+random walk of similarity transforms, with a few moving boxes on top that
+are passed as detections. Each CMCComputer method estimates the affine
+between consecutive frames. The report gives the frames per second and the
+warp error: the mean distance, in pixels, between a grid of points mapped
+by the estimated and by the true affine.
+
+With --detector_ms, it also times each method inline and in a CMCWorker.
+A sleep stands in for the detector, which waits on the GPU without the GIL.
+
+    python -m benchmarks.bench_cmc --methods sparse sift fast --frames 20 --size 540 960
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from trackers.integrated_ocsort_embedding.cmc import CMCComputer, CMCWorker
+
+
+def make_frames(n_frames, size=(1080, 1920), n_boxes=20, seed=0):
+    rng = np.random.RandomState(seed)
+    h, w = size
+    # Blurred noise at several scales, corners for both flow and SIFT
+    base = np.zeros((2 * h, 2 * w), dtype=np.float32)
+    for k in (3, 9, 27):
+        noise = rng.rand(2 * h // k + 1, 2 * w // k + 1).astype(np.float32)
+        base += cv2.resize(noise, (2 * w, 2 * h), interpolation=cv2.INTER_CUBIC)
+    base = cv2.normalize(base, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    base = cv2.cvtColor(base, cv2.COLOR_GRAY2BGR)
+
+    pos = rng.uniform([0, 0], [w - 100, h - 250], size=(n_boxes, 2))
+    vel = rng.normal(0, 5, size=(n_boxes, 2))
+    colors = rng.randint(0, 255, size=(n_boxes, 3))
+    # Camera pose: maps the base image to the frame
+    angle, zoom, shift = 0.0, 1.0, np.array([-w / 2, -h / 2])
+    frames, affines = [], []
+    for f in range(n_frames):
+        angle += rng.normal(0, 0.2)
+        zoom *= 1 + rng.normal(0, 0.003)
+        shift += rng.normal(0, 4, size=2)
+        pose = cv2.getRotationMatrix2D((w, h), angle, zoom)
+        pose[:, 2] += shift
+        frame = cv2.warpAffine(base, pose, (w, h))
+        boxes = np.concatenate((pos + vel * f, pos + vel * f + [100, 250]), axis=1)
+        for box, color in zip(boxes.astype(int), colors):
+            cv2.rectangle(frame, tuple(box[:2]), tuple(box[2:]), color.tolist(), -1)
+        frames.append((frame, boxes))
+        affines.append(pose)
+    return frames, affines
+
+
+def true_affine(prev_pose, pose):
+    """The affine of the previous frame to the frame."""
+    prev = np.vstack((prev_pose, [0, 0, 1]))
+    return (np.vstack((pose, [0, 0, 1])) @ np.linalg.inv(prev))[:2]
+
+
+def warp_error(A, B, size):
+    h, w = size
+    ys, xs = np.mgrid[0:h:40, 0:w:40]
+    points = np.stack((xs.ravel(), ys.ravel(), np.ones(xs.size)))
+    return np.linalg.norm((A - B) @ points, axis=0).mean()
+
+
+def benchmark(method, frames, affines):
+    cmc = CMCComputer(method=method)
+    errors = []
+    start = time.perf_counter()
+    for f, (frame, boxes) in enumerate(frames):
+        A = cmc.compute_affine(frame, boxes, f"bench:{f + 1}")
+        if f > 0:
+            errors.append(warp_error(A, true_affine(affines[f - 1], affines[f]), frame.shape[:2]))
+    elapsed = time.perf_counter() - start
+    return len(frames) / elapsed, np.mean(errors), np.max(errors)
+
+
+def benchmark_overlap(method, frames, detector_ms):
+    """Frames per second of detection + CMC, inline and in the background."""
+    fps = []
+    for background in (False, True):
+        cmc = CMCComputer(method=method)
+        worker = CMCWorker(cmc)
+        start = time.perf_counter()
+        for f, (frame, boxes) in enumerate(frames):
+            tag = f"overlap{int(background)}:{f + 1}"
+            if background:
+                worker.submit(frame, boxes, tag)
+            time.sleep(detector_ms / 1000)
+            if background:
+                worker.result(frame, boxes, tag)
+            else:
+                cmc.compute_affine(frame, boxes, tag)
+        fps.append(len(frames) / (time.perf_counter() - start))
+        worker.close()
+    return fps
+
+
+def main():
+    parser = argparse.ArgumentParser("Camera motion compensation benchmark")
+    parser.add_argument("--methods", type=str, nargs="+", default=["sparse", "sift", "fast"])
+    parser.add_argument("--frames", type=int, default=20)
+    # SIFT takes seconds per full HD frame
+    parser.add_argument("--size", type=int, nargs=2, default=[540, 960], help="height width")
+    parser.add_argument("--detector_ms", type=float, default=None, help="also time the background CMC")
+    args = parser.parse_args()
+
+    frames, affines = make_frames(args.frames, tuple(args.size))
+    for method in args.methods:
+        fps, mean_error, max_error = benchmark(method, frames, affines)
+        print(f"{method:>7}: {fps:7.2f} FPS, warp error mean {mean_error:7.3f} px, max {max_error:7.3f} px")
+        if args.detector_ms is not None:
+            inline, background = benchmark_overlap(method, frames, args.detector_ms)
+            detector = f"with a {args.detector_ms:g} ms detector"
+            print(f"{'':>7}  {detector}: {inline:7.2f} FPS inline, {background:7.2f} FPS in a worker")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark of the first-round association cost construction.
+
+Runs associate() on sequences of crowded synthetic frames (jittered moving
+boxes with embeddings, so that the IoU shortcut does not apply) with the
+costs built by the reference numpy code and by costs.CostBuilder, and
+reports the time per frame and the peak memory allocated during a frame
+(tracemalloc). The matches are checked to be the same.
+
+    python -m benchmarks.bench_cost --tracks 50 200 500
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from trackers.integrated_ocsort_embedding.association import associate
+from trackers.integrated_ocsort_embedding.costs import CostBuilder
+
+
+def make_frames(n_tracks, n_frames, dim=512, seed=0):
+    rng = np.random.RandomState(seed)
+    # Denser than MOT20 so that most tracks overlap several detections
+    pos = rng.uniform([0, 0], [1200, 700], size=(n_tracks, 2))
+    vel = rng.normal(0, 2, size=(n_tracks, 2))
+    size = rng.uniform([25, 60], [60, 150], size=(n_tracks, 2))
+    embs = rng.normal(size=(n_tracks, dim))
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    velocities = vel / np.linalg.norm(vel, axis=1, keepdims=True)
+    frames = []
+    for f in range(n_frames):
+        trks = np.concatenate((pos + vel * f, pos + vel * f + size), axis=1)
+        seen = rng.rand(n_tracks) > 0.1
+        dets = trks[seen] + rng.normal(0, 3, size=(seen.sum(), 4))
+        dets = np.concatenate((dets, rng.uniform(0.6, 1.0, size=(len(dets), 1))), axis=1)
+        det_embs = embs[seen] + rng.normal(0, 0.1, size=(seen.sum(), dim))
+        det_embs /= np.linalg.norm(det_embs, axis=1, keepdims=True)
+        previous_obs = np.concatenate((trks - vel.repeat(2, axis=1) * 3, np.ones((n_tracks, 1))), axis=1)
+        frames.append((dets, trks, det_embs, embs, velocities, previous_obs))
+    return frames
+
+
+def run_frame(frame, builder):
+    dets, trks, det_embs, trk_embs, velocities, previous_obs = frame
+    return associate(
+        dets,
+        trks,
+        det_embs,
+        trk_embs,
+        0.3,
+        velocities,
+        previous_obs,
+        0.2,
+        0.75,
+        False,
+        0.5,
+        False,
+        True,
+        cost_builder=builder,
+    )
+
+
+def benchmark(frames, builder):
+    out = []
+    start = time.perf_counter()
+    for frame in frames:
+        out.append(run_frame(frame, builder))
+    elapsed = (time.perf_counter() - start) / len(frames)
+
+    peak = 0
+    tracemalloc.start()
+    for frame in frames:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        run_frame(frame, builder)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return elapsed, peak, out
+
+
+def main():
+    parser = argparse.ArgumentParser("Association cost benchmark")
+    parser.add_argument("--tracks", type=int, nargs="+", default=[50, 200, 500])
+    parser.add_argument("--frames", type=int, default=20)
+    args = parser.parse_args()
+
+    for n in args.tracks:
+        frames = make_frames(n, args.frames)
+        print(f"{n} tracks")
+        reference = None
+        for name, dtype in (("reference", None), ("fused f64", np.float64), ("fused f32", np.float32)):
+            builder = None if dtype is None else CostBuilder(dtype)
+            t, peak, out = benchmark(frames, builder)
+            if reference is None:
+                reference = out
+            same = all(np.array_equal(a[0], b[0]) for a, b in zip(reference, out))
+            print(f"{name:>10}: {1000 * t:8.3f} ms/frame, peak {peak / 2**20:7.2f} MiB, same matches {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Microbenchmark of the batched Kalman filter against the per-object filter.
+
+Runs the predict/update cycle of the new_kf (8-state) and the SORT (7-state)
+box models for N tracks, once with one KalmanFilterNew per track and once
+with a single BatchKalmanFilter, and reports the time per frame.
+
+    python -m benchmarks.bench_kalman --frames 200 --tracks 10 50 150 500
+"""
+import argparse
+import time
+
+import numpy as np
+
+from trackers.integrated_ocsort_embedding.batchkalman import (
+    BatchKalmanFilter,
+    new_kf_measurement_noise_batch,
+    new_kf_process_noise_batch,
+)
+from trackers.integrated_ocsort_embedding.kalmanfilter import KalmanFilterNew
+from trackers.integrated_ocsort_embedding.ocsort import new_kf_measurement_noise, new_kf_process_noise
+
+
+def make_measurements(n_tracks, n_frames, seed=0):
+    rng = np.random.RandomState(seed)
+    start = rng.uniform([0, 0, 30, 80], [1800, 900, 90, 220], size=(n_tracks, 4))
+    vel = rng.normal(0, 3, size=(n_tracks, 4)) * [1, 1, 0.05, 0.05]
+    t = np.arange(n_frames)[:, None, None]
+    zs = start[None] + vel[None] * t + rng.normal(0, 1, size=(n_frames, n_tracks, 4))
+    return zs
+
+
+def to_sort_z(z):
+    """[x, y, w, h] to the [x, y, s, r] measurement of the 7-state model."""
+    return np.stack((z[..., 0], z[..., 1], z[..., 2] * z[..., 3], z[..., 2] / z[..., 3]), axis=-1)
+
+
+def run_per_object(zs, new_kf):
+    template = BatchKalmanFilter.box_filter(new_kf)
+    filters = []
+    for z in zs[0]:
+        kf = KalmanFilterNew(dim_x=template.dim_x, dim_z=4)
+        kf.F, kf.H, kf.Q, kf.R = template.F.copy(), template.H.copy(), template.Q.copy(), template.R.copy()
+        kf.x[:4, 0] = z
+        filters.append(kf)
+
+    start = time.perf_counter()
+    for frame in zs[1:]:
+        for kf, z in zip(filters, frame):
+            if new_kf:
+                kf.predict(Q=new_kf_process_noise(kf.x[2, 0], kf.x[3, 0]))
+                kf.update(z.reshape(4, 1), R=new_kf_measurement_noise(kf.x[2, 0], kf.x[3, 0]), new_kf=True)
+            else:
+                kf.predict()
+                kf.update(z.reshape(4, 1))
+    elapsed = time.perf_counter() - start
+    return elapsed, np.array([kf.x[:, 0] for kf in filters])
+
+
+def run_batched(zs, new_kf):
+    kf = BatchKalmanFilter.box_filter(new_kf)
+    x = np.zeros((zs.shape[1], kf.dim_x))
+    x[:, :4] = zs[0]
+    kf.add(x, np.repeat(np.eye(kf.dim_x)[None], zs.shape[1], axis=0))
+    rows = np.arange(zs.shape[1])
+
+    start = time.perf_counter()
+    for frame in zs[1:]:
+        if new_kf:
+            kf.predict(Q=new_kf_process_noise_batch(kf.x[:, 2], kf.x[:, 3]))
+            kf.update(rows, frame, R=new_kf_measurement_noise_batch(kf.x[:, 2], kf.x[:, 3]))
+        else:
+            kf.predict()
+            kf.update(rows, frame)
+    elapsed = time.perf_counter() - start
+    return elapsed, kf.x.copy()
+
+
+def main():
+    parser = argparse.ArgumentParser("Kalman filter microbenchmark")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--tracks", type=int, nargs="+", default=[10, 50, 150, 500])
+    args = parser.parse_args()
+
+    print(f"{'model':>8} {'tracks':>7} {'per-object ms/frame':>20} {'batched ms/frame':>17} {'speedup':>8} {'max |dx|':>9}")
+    for new_kf in (True, False):
+        for n in args.tracks:
+            zs = make_measurements(n, args.frames)
+            if not new_kf:
+                zs = to_sort_z(zs)
+            t_obj, x_obj = run_per_object(zs, new_kf)
+            t_bat, x_bat = run_batched(zs, new_kf)
+            frames = args.frames - 1
+            print(
+                f"{'8-state' if new_kf else '7-state':>8} {n:>7} {1000 * t_obj / frames:>20.3f} "
+                f"{1000 * t_bat / frames:>17.3f} {t_obj / t_bat:>7.1f}x {np.abs(x_obj - x_bat).max():>9.2e}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark of the linear assignment backends of assignment.LAP_SOLVERS.
+
+Real cost matrices are recorded by running the tracker with --lap_dump, e.g.
+
+    python main.py --exp_name dump --dataset mot20 --lap_dump cache/lap_costs/mot20
+    python -m benchmarks.bench_lap --costs cache/lap_costs/mot20
+
+Without --costs, sequences of synthetic association costs (IoU + embedding
+similarity of jittered moving boxes) are generated for each --tracks size.
+For every backend the time per problem and the total cost relative to the
+exact solution are reported. "auction+warm" passes the column prices of the
+previous problem as warm start, as the tracker does.
+"""
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+
+from trackers.integrated_ocsort_embedding.assignment import LAP_SOLVERS, get_solver
+from trackers.integrated_ocsort_embedding.association import iou_batch
+
+
+def load_costs(folder):
+    return [np.load(f) for f in sorted(glob.glob(os.path.join(folder, "*.npy")))]
+
+
+def make_costs(n_tracks, n_frames, seed=0):
+    rng = np.random.RandomState(seed)
+    # MOT20-like density: ~n_tracks pedestrians on a 1920 x 1080 frame
+    pos = rng.uniform([0, 0], [1850, 950], size=(n_tracks, 2))
+    vel = rng.normal(0, 2, size=(n_tracks, 2))
+    size = rng.uniform([25, 60], [60, 150], size=(n_tracks, 2))
+    embs = rng.normal(size=(n_tracks, 128))
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    costs = []
+    for f in range(n_frames):
+        trks = np.concatenate((pos + vel * f, pos + vel * f + size), axis=1)
+        seen = rng.rand(n_tracks) > 0.1
+        dets = trks[seen] + rng.normal(0, 3, size=(seen.sum(), 4))
+        det_embs = embs[seen] + rng.normal(0, 0.1, size=(seen.sum(), 128))
+        det_embs /= np.linalg.norm(det_embs, axis=1, keepdims=True)
+        costs.append(-(iou_batch(dets, trks) + 0.75 * det_embs @ embs.T))
+    return costs
+
+
+def run(solver, costs, warm):
+    prices = None
+    out = []
+    start = time.perf_counter()
+    for cost in costs:
+        if prices is not None and len(prices) != cost.shape[1]:
+            prices = None
+        out.append(solver(cost, prices if warm else None))
+        prices = solver.prices
+    elapsed = time.perf_counter() - start
+    total = sum(c[m[:, 0], m[:, 1]].sum() for c, m in zip(costs, out))
+    return elapsed / len(costs), total
+
+
+def benchmark(name, costs):
+    exact = None
+    print(f"{name}: {len(costs)} problems, mean size {np.mean([c.shape[0] for c in costs]):.0f} x "
+          f"{np.mean([c.shape[1] for c in costs]):.0f}")
+    for backend in list(LAP_SOLVERS) + ["auction+warm"]:
+        try:
+            solver = get_solver(backend.split("+")[0])
+        except ImportError:
+            print(f"{backend:>14}: not installed")
+            continue
+        t, total = run(solver, costs, backend.endswith("+warm"))
+        if exact is None:
+            exact = total
+        print(f"{backend:>14}: {1000 * t:8.3f} ms/problem, total cost {total:.4f} (gap {total - exact:.2e})")
+
+
+def main():
+    parser = argparse.ArgumentParser("Linear assignment benchmark")
+    parser.add_argument("--costs", type=str, default=None, help="folder of .npy costs saved with --lap_dump")
+    parser.add_argument("--tracks", type=int, nargs="+", default=[50, 200, 500])
+    parser.add_argument("--frames", type=int, default=30)
+    args = parser.parse_args()
+
+    if args.costs is not None:
+        benchmark(args.costs, load_costs(args.costs))
+    else:
+        for n in args.tracks:
+            benchmark(f"synthetic {n} tracks", make_costs(n, args.frames))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,21 @@
 """Generic detector."""
 import os
 import pickle
+import shutil
 
+import numpy as np
 import torch
 
 from external.adaptors import yolox_adaptor
+from trackers.integrated_ocsort_embedding.cachekeys import config_digest, file_digest
+from trackers.integrated_ocsort_embedding.cachemanager import CACHE
+from trackers.integrated_ocsort_embedding.framecache import FrameArrayCache, convert_pickle
 
 
 class Detector(torch.nn.Module):
     K_MODELS = {"yolox"}
+    # Shape of an output row of each model, (x1, y1, x2, y2, conf) for yolox_adaptor.PostModel
+    ROW_SHAPES = {"yolox": (5,)}
 
     def __init__(self, model_type, path, dataset):
         super().__init__()
@@ -21,15 +28,44 @@ class Detector(torch.nn.Module):
         self.model = None
 
         os.makedirs("./cache", exist_ok=True)
-        self.cache_path = os.path.join(
-            "./cache", f"det_{os.path.basename(path).split('.')[0]}.pkl"
-        )
-        self.cache = {}
-        if os.path.exists(self.cache_path):
-            with open(self.cache_path, "rb") as fp:
-                self.cache = pickle.load(fp)
-        else:
-            self.initialize_model()
+        # Namespace of the shared cache, backed by one FrameArrayCache of the
+        # output rows per sequence, attached when the sequence is reached.
+        # The model is only loaded on a cache miss.
+        # The folder is keyed by the content of the weights, retrained weights
+        # under the same file name do not reuse stale detections.
+        name = f"det_{os.path.basename(path).split('.')[0]}"
+        namespace = config_digest(file_digest(path), model_type, dataset)
+        self.cache_path = os.path.join("./cache", f"{name}_{namespace}")
+        pickle_path = os.path.join("./cache", f"{name}.pkl")
+        if not os.path.exists(self.cache_path) and os.path.exists(pickle_path):
+            self._convert_pickle(pickle_path)
+        self.cache = CACHE.namespace(os.path.basename(self.cache_path))
+        self.cache_name = ""
+        # Shape of an output row, to store the frames without detections
+        # even before the first detection. Read back from an existing cache.
+        self.row_shape = self.ROW_SHAPES[model_type]
+
+    def _convert_pickle(self, pickle_path):
+        """Splits the former whole-dataset pickle into per-sequence caches."""
+        print(f"Converting {pickle_path} to {self.cache_path}")
+        with open(pickle_path, "rb") as fp:
+            cache = pickle.load(fp)
+        sequences = {}
+        for tag, output in cache.items():
+            sequences.setdefault(tag.split(":")[0], {})[tag] = output.numpy()
+        tmp = self.cache_path + ".tmp"
+        # Leftovers of an interrupted conversion
+        shutil.rmtree(tmp, ignore_errors=True)
+        for seq, outputs in sequences.items():
+            convert_pickle(outputs, os.path.join(tmp, seq))
+        os.makedirs(tmp, exist_ok=True)
+        os.rename(tmp, self.cache_path)
+
+    def _load_cache(self, seq):
+        self.cache_name = seq
+        store = FrameArrayCache(os.path.join(self.cache_path, seq), row_shape=self.ROW_SHAPES[self.model_type])
+        self.cache.attach(store)
+        self.row_shape = store.row_shape
 
     def initialize_model(self):
         """Wait until needed."""
@@ -37,18 +73,25 @@ class Detector(torch.nn.Module):
             self.model = yolox_adaptor.get_model(self.path, self.dataset)
 
     def forward(self, batch, tag=None):
-        if tag in self.cache:
-            return self.cache[tag]
+        if tag is not None and self.cache_name != tag.split(":")[0]:
+            self._load_cache(tag.split(":")[0])
+        output = None if tag is None else self.cache.get(tag)
+        if output is not None:
+            # Frames without detections are stored empty, the model gives None.
+            # A copy, the cached rows must not change with the returned tensor.
+            return torch.from_numpy(output.copy()) if len(output) > 0 else None
         if self.model is None:
             self.initialize_model()
 
         with torch.no_grad():
             output = self.model(batch)
-        if output is not None:
-            self.cache[tag] = output.cpu()
+        if tag is not None:
+            if output is not None:
+                self.cache.put(tag, output.cpu().numpy().copy())
+            else:
+                self.cache.put(tag, np.empty((0,) + self.row_shape, dtype=np.float32))
 
         return output
 
     def dump_cache(self):
-        with open(self.cache_path, "wb") as fp:
-            pickle.dump(self.cache, fp)
+        CACHE.flush()
@@ -11,6 +11,7 @@ import dataset
 import utils
 from external.adaptors import detector
 from trackers import integrated_ocsort_embedding as tracker_module
+from trackers.integrated_ocsort_embedding.cachemanager import CACHE
 
 
 def get_main_args():
@@ -40,10 +41,32 @@ def get_main_args():
     )
     parser.add_argument("--emb_off", action="store_true")
     parser.add_argument("--cmc_off", action="store_true")
+    parser.add_argument("--cmc_method", type=str, default="file", help="file, sparse, sift or fast")
+    parser.add_argument("--cmc_async", action="store_true", help="run the CMC in a thread during the detection")
     parser.add_argument("--aw_off", action="store_true")
     parser.add_argument("--aw_param", type=float, default=0.5)
     parser.add_argument("--new_kf_off", action="store_true")
     parser.add_argument("--grid_off", action="store_true")
+    parser.add_argument(
+        "--approx_gating", action="store_true", help="approximate: associate only the overlapping pairs"
+    )
+    parser.add_argument("--decompose_lap", action="store_true", help="one assignment per cluster of overlaps")
+    parser.add_argument("--lap_solver", type=str, default="auto", help="auto, lapjv, scipy, auction or greedy")
+    parser.add_argument("--lap_dump", type=str, default=None, help="save the assignment costs to this folder")
+    parser.add_argument("--reid_budget", type=int, default=0, help="max consecutive embedding reuses, 0: no limit")
+    parser.add_argument("--reid_adaptive", action="store_true", help="smaller reuse budget for fast tracks")
+    parser.add_argument("--target_fps", type=float, default=None, help="degrade the ReID work to keep this frame rate")
+    parser.add_argument("--lazy_emb", action="store_true", help="only embed the ambiguous detections")
+    parser.add_argument("--min_visibility", type=float, default=0.0, help="skip the ReID of more hidden detections")
+    parser.add_argument("--emb_cache_dtype", type=str, default="float32", help="float32 or float16 cached embeddings")
+    parser.add_argument("--cache_budget", type=float, default=1024, help="MB of RAM of all the in-memory caches")
+    parser.add_argument("--cache_flush_interval", type=float, default=30, help="seconds between two cache writes")
+    parser.add_argument(
+        "--cost_dtype",
+        type=str,
+        default="float64",
+        help="float64, float32 (faster, can flip near ties) or none for the unfused association costs",
+    )
 
     parser.add_argument("--occlusion_threshold", type=float, default=0.2)
     parser.add_argument("--aspect_ratio_threshold", type=float, default=0.65)
@@ -66,6 +89,8 @@ def main():
     np.set_printoptions(suppress=True, precision=5)
     # Set dataset and detector
     args = get_main_args()
+    CACHE.budget = int(args.cache_budget * 2**20)
+    CACHE.flush_interval = args.cache_flush_interval
 
     if args.dataset == "mot17":
         if args.test_dataset:
@@ -102,10 +127,23 @@ def main():
         alpha_fixed_emb=args.alpha_fixed_emb,
         embedding_off=args.emb_off,
         cmc_off=args.cmc_off,
+        cmc_method=args.cmc_method,
+        cmc_async=args.cmc_async,
         aw_off=args.aw_off,
         aw_param=args.aw_param,
         new_kf_off=args.new_kf_off,
         grid_off=args.grid_off,
+        approx_gating=args.approx_gating,
+        decompose_lap=args.decompose_lap,
+        lap_solver=args.lap_solver,
+        lap_dump=args.lap_dump,
+        cost_dtype=None if args.cost_dtype == "none" else args.cost_dtype,
+        reid_budget=args.reid_budget,
+        reid_adaptive=args.reid_adaptive,
+        target_fps=args.target_fps,
+        lazy_embeddings=args.lazy_emb,
+        min_visibility=args.min_visibility,
+        emb_cache_dtype=args.emb_cache_dtype,
         occlusion_threshold=args.occlusion_threshold,
         aspect_ratio_threshold=args.aspect_ratio_threshold,
         angle_threshold=args.angle_threshold,
@@ -134,11 +172,17 @@ def main():
         if frame_id == 1:
             print(f"Initializing tracker for {video_name}")
             print(f"Time spent: {total_time:.3f}, FPS {frame_count / (total_time + 1e-9):.2f}")
+            print(f"ReID skip rate of the last sequence: {tracker.embedding_reuse.skip_rate:.3f}")
+            print(f"Degradation levels of the last sequence: {tracker.latency.summary()}")
+            print(f"Occluded crops skipped in the last sequence: {tracker.crop_suppression.saved}")
             tracker.dump_cache()
+            tracker.close()
             tracker = tracker_module.ocsort.OCSort(**oc_sort_args)
 
         start_time = time.time()
 
+        # Overlaps with the detection when --cmc_async
+        tracker.start_cmc(np_img[0].numpy(), tag)
         # Nx5 of (x1, y1, x2, y2, conf), pass in tag for caching
         pred = det(img, tag)
         if pred is None:
@@ -172,9 +216,14 @@ def main():
         results[video_name].append((frame_id, tlwhs, ids))
 
     print(f"Time spent: {total_time:.3f}, FPS {frame_count / (total_time + 1e-9):.2f}")
+    print(f"ReID skip rate of the last sequence: {tracker.embedding_reuse.skip_rate:.3f}")
+    print(f"Degradation levels of the last sequence: {tracker.latency.summary()}")
+    print(f"Occluded crops skipped in the last sequence: {tracker.crop_suppression.saved}")
     # Save detector results
     det.dump_cache()
     tracker.dump_cache()
+    tracker.close()
+    print(CACHE.summary())
 
     # Save for all sequences
     folder = os.path.join(args.result_folder, args.exp_name, "data")
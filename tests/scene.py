@@ -0,0 +1,80 @@
+"""
+Synthetic scenes for the tests: boxes moving at constant velocity with a
+few missed detections and false positives, and one unit embedding per
+object. The trackers get the embeddings and the camera motion from the
+scene instead of the ReID model and the CMC files.
+"""
+import argparse
+
+import numpy as np
+
+from trackers.integrated_ocsort_embedding.ocsort import OCSort
+
+
+class FakeImage(object):
+    def __init__(self, shape):
+        self.shape = shape
+
+
+IMG_TENSOR = FakeImage((1, 3, 800, 1440))
+IMG_NUMPY = FakeImage((1080, 1920, 3))
+
+
+def make_scene(seed, n_frames=60, n_obj=20, dim=512, size=(1080, 1920)):
+    """The detections and object ids of every frame, the object embeddings."""
+    rng = np.random.RandomState(seed)
+    h, w = size
+    pos = rng.uniform([0, 0], [w - 100, h - 200], size=(n_obj, 2))
+    vel = rng.normal(0, 4, size=(n_obj, 2))
+    box = rng.uniform([30, 80], [90, 220], size=(n_obj, 2))
+    birth = rng.randint(0, n_frames // 2, size=n_obj)
+    death = birth + rng.randint(10, n_frames, size=n_obj)
+    embs = rng.normal(size=(n_obj, dim))
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    frames = []
+    for f in range(n_frames):
+        dets, ids = [], []
+        for i in np.where((birth <= f) & (f < death))[0]:
+            if rng.rand() < 0.1:
+                continue
+            p = pos[i] + vel[i] * f + rng.normal(0, 2, 2)
+            s = box[i] * (1 + rng.normal(0, 0.03, 2))
+            dets.append([p[0], p[1], p[0] + s[0], p[1] + s[1], rng.uniform(0.3, 1.0)])
+            ids.append(i)
+        if rng.rand() < 0.2:
+            p = rng.uniform([0, 0], [w, h])
+            dets.append([p[0], p[1], p[0] + 50, p[1] + 120, rng.uniform(0.5, 1.0)])
+            ids.append(-1)
+        frames.append((np.array(dets).reshape(-1, 5), np.array(ids, dtype=int)))
+    return frames, embs
+
+
+def make_tracker(frames, embs, **kwargs):
+    """An OCSort whose embedder and CMC read the scene."""
+    args = argparse.Namespace(dataset="mot17", test_dataset=False)
+    tracker = OCSort(det_thresh=0.6, args=args, grid_off=True, **kwargs)
+    crops = []
+
+    def compute_embedding(img, bboxes, tag):
+        f = int(tag.split(":")[1]) - 1
+        dets, ids = frames[f]
+        out = []
+        for bbox in bboxes:
+            j = np.argmin(np.abs(dets[:, :4] - bbox[None, :4]).sum(1))
+            e = embs[ids[j]] if ids[j] >= 0 else np.full(embs.shape[1], embs.shape[1] ** -0.5)
+            e = e + np.random.RandomState(f * 1000 + j).normal(0, 0.05, e.shape)
+            out.append(e / np.linalg.norm(e))
+        crops.append(len(bboxes))
+        return np.array(out).reshape(len(bboxes), embs.shape[1])
+
+    tracker.embedder.compute_embedding = compute_embedding
+    tracker.cmc.compute_affine = lambda img, bboxes, tag: np.eye(2, 3)
+    tracker.crops = crops
+    return tracker
+
+
+def run(tracker, frames):
+    """The outputs of every frame."""
+    return [
+        tracker.update(dets.copy(), IMG_TENSOR, IMG_NUMPY, f"scene:{f + 1}") for f, (dets, ids) in enumerate(frames)
+    ]
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from trackers.integrated_ocsort_embedding.assignment import LAP_SOLVERS, get_solver
+
+from .scene import make_scene, make_tracker
+
+SHAPES = [(1, 1), (1, 6), (6, 1), (12, 12), (30, 20), (20, 30)]
+
+
+def total(cost, matches):
+    return cost[matches[:, 0], matches[:, 1]].sum()
+
+
+def check_matching(cost, matches):
+    assert len(matches) == min(cost.shape)
+    assert len(np.unique(matches[:, 0])) == len(matches) == len(np.unique(matches[:, 1]))
+    assert np.all(np.diff(matches[:, 0]) > 0)
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_exact_solvers(shape):
+    rng = np.random.RandomState(0)
+    lapjv, scipy, auction = get_solver("lapjv"), get_solver("scipy"), get_solver("auction")
+    for _ in range(5):
+        cost = -rng.uniform(0, 2, size=shape)
+        expected = lapjv(cost)
+        check_matching(cost, expected)
+        np.testing.assert_array_equal(scipy(cost), expected)
+        matches = auction(cost)
+        check_matching(cost, matches)
+        assert total(cost, matches) <= total(cost, expected) + min(shape) * auction.eps_end
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_greedy_bound(shape):
+    rng = np.random.RandomState(1)
+    for _ in range(5):
+        cost = -rng.uniform(0, 2, size=shape)
+        matches = get_solver("greedy")(cost)
+        check_matching(cost, matches)
+        # Half of the optimal benefit at least
+        assert total(cost, matches) <= total(cost, get_solver("lapjv")(cost)) / 2
+
+
+def test_greedy_non_finite():
+    greedy = get_solver("greedy")
+    assert len(greedy(np.full((3, 4), np.inf))) == 0
+    assert len(greedy(np.full((4, 3), np.nan))) == 0
+    cost = np.array([[-1.0, np.nan, np.inf], [np.nan, np.inf, np.inf], [np.inf, -2.0, np.nan]])
+    np.testing.assert_array_equal(greedy(cost), [[0, 0], [2, 1]])
+
+
+def test_auction_warm_start():
+    rng = np.random.RandomState(2)
+    auction = get_solver("auction")
+    assert auction.warm_start and not any(LAP_SOLVERS[name].warm_start for name in ("lapjv", "scipy", "greedy"))
+    cost = -rng.uniform(0, 2, size=(20, 25))
+    auction(cost)
+    prices = auction.prices
+    # The next frame is close to the previous one
+    cost += rng.normal(0, 0.01, size=cost.shape)
+    matches = auction(cost, prices)
+    assert total(cost, matches) <= total(cost, get_solver("lapjv")(cost)) + 20 * auction.eps_end
+    # Transposed, the warm start is dropped
+    assert auction(cost.T, prices) is not None and auction.prices is None
+
+
+def test_approx_gating_takes_no_solver():
+    frames, embs = make_scene(0)
+    with pytest.raises(ValueError, match="approx_gating"):
+        make_tracker(frames, embs, approx_gating=True, lap_solver="auction")
+    with pytest.raises(ValueError, match="approx_gating"):
+        make_tracker(frames, embs, approx_gating=True, decompose_lap=True)
@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+import scipy.spatial as sp
+
+from trackers.integrated_ocsort_embedding.assignment import get_solver
+from trackers.integrated_ocsort_embedding.association import (
+    AssociationContext,
+    component_assignment,
+    compute_aw_new_metric,
+    split_cosine_dist,
+    split_cosine_dist_pairs,
+    top2_gap,
+)
+
+
+def reference_aw_new_metric(emb_cost, w_association_emb, max_diff=0.5):
+    """The per-row / per-column loop that compute_aw_new_metric replaced."""
+    w_emb = np.full_like(emb_cost, w_association_emb)
+    w_emb_bonus = np.full_like(emb_cost, 0)
+    if emb_cost.shape[1] >= 2:
+        for idx in range(emb_cost.shape[0]):
+            inds = np.argsort(-emb_cost[idx])
+            row_weight = min(emb_cost[idx, inds[0]] - emb_cost[idx, inds[1]], max_diff)
+            w_emb_bonus[idx] += row_weight / 2
+    if emb_cost.shape[0] >= 2:
+        for idj in range(emb_cost.shape[1]):
+            inds = np.argsort(-emb_cost[:, idj])
+            col_weight = min(emb_cost[inds[0], idj] - emb_cost[inds[1], idj], max_diff)
+            w_emb_bonus[:, idj] += col_weight / 2
+    return w_emb + w_emb_bonus
+
+
+def reference_split_cosine_dist(dets, trks, affinity_thresh=0.55, hard_thresh=True):
+    """The per-pair cdist loop that split_cosine_dist replaced."""
+    cos_dist = np.zeros((len(dets), len(trks)))
+    for i in range(len(dets)):
+        for j in range(len(trks)):
+            cos_d = 1 - sp.distance.cdist(dets[i], trks[j], "cosine")
+            patch_affinity = np.max(cos_d, axis=0)
+            if hard_thresh and not np.all(patch_affinity > affinity_thresh):
+                cos_dist[i, j] = 0
+            else:
+                cos_dist[i, j] = np.max(patch_affinity)
+    return cos_dist
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (1, 5), (5, 1), (2, 2), (7, 13), (40, 30)])
+def test_aw_new_metric(shape):
+    rng = np.random.RandomState(0)
+    emb_cost = rng.uniform(-1, 1, size=shape)
+    np.testing.assert_array_equal(compute_aw_new_metric(emb_cost, 0.75), reference_aw_new_metric(emb_cost, 0.75))
+
+
+def test_top2_gap_ties():
+    rng = np.random.RandomState(1)
+    x = rng.randint(0, 3, size=(20, 6)).astype(float)
+    for axis in (0, 1):
+        ordered = -np.sort(-x, axis=axis)
+        expected = np.take(ordered, 0, axis=axis) - np.take(ordered, 1, axis=axis)
+        np.testing.assert_array_equal(top2_gap(x, axis), expected)
+
+
+def grid_embeddings(rng, n, base):
+    """n noisy copies of the base (K, 3, D) grid embeddings, some far off."""
+    embs = base[rng.randint(0, len(base), size=n)] + rng.normal(0, 0.5, size=(n,) + base.shape[1:])
+    return embs * rng.uniform(0.5, 2, size=(n, 1, 1))
+
+
+@pytest.mark.parametrize("hard_thresh", [True, False])
+def test_split_cosine_dist(hard_thresh):
+    rng = np.random.RandomState(2)
+    base = rng.normal(size=(5, 3, 32))
+    dets, trks = grid_embeddings(rng, 12, base), grid_embeddings(rng, 9, base)
+    expected = reference_split_cosine_dist(dets, trks, hard_thresh=hard_thresh)
+    if hard_thresh:
+        # Both sides of the threshold
+        assert 0 < np.count_nonzero(expected) < expected.size
+    np.testing.assert_allclose(split_cosine_dist(dets, trks, hard_thresh=hard_thresh), expected, atol=1e-12)
+    d, t = np.divmod(np.arange(12 * 9), 9)
+    np.testing.assert_allclose(
+        split_cosine_dist_pairs(dets[d], trks[t], hard_thresh=hard_thresh), expected[d, t], atol=1e-12
+    )
+
+
+def test_split_cosine_dist_empty():
+    assert split_cosine_dist(np.zeros((0, 3, 8)), np.ones((4, 3, 8))).shape == (0, 4)
+    assert split_cosine_dist(np.ones((4, 3, 8)), np.zeros((0, 3, 8))).shape == (4, 0)
+
+
+def clustered_costs(rng, n, m, n_clusters=6):
+    """Random costs and the adjacency of a few clusters of rows and columns."""
+    adjacency = (rng.randint(0, n_clusters, size=(n, 1)) == rng.randint(0, n_clusters, size=(1, m))) & (
+        rng.rand(n, m) < 0.7
+    )
+    return -rng.uniform(0.3, 2, size=(n, m)), adjacency
+
+
+def as_set(matches):
+    return set(map(tuple, np.asarray(matches).tolist()))
+
+
+@pytest.mark.parametrize("shape", [(8, 8), (25, 18), (18, 25), (60, 60)])
+def test_component_assignment(shape):
+    # With the non-adjacent pairs priced out, the same matching as one
+    # global lapjv, whichever solver solves the components
+    rng = np.random.RandomState(3)
+    lapjv = get_solver("lapjv")
+    for _ in range(10):
+        cost, adjacency = clustered_costs(rng, *shape)
+        cost[~adjacency] = 1e6
+        reference = lapjv(cost)
+        expected = as_set(reference[adjacency[reference[:, 0], reference[:, 1]]])
+        for name in ("lapjv", "scipy"):
+            matches = component_assignment(cost, adjacency, get_solver(name))
+            assert np.all(np.diff(matches[:, 0]) > 0)
+            assert as_set(matches[adjacency[matches[:, 0], matches[:, 1]]]) == expected
+
+
+def test_sparse_context():
+    # The IoU of the overlapping pairs only, the same matrix and candidates
+    rng = np.random.RandomState(4)
+    xy = rng.uniform(0, 2000, size=(300, 2))
+    dets = np.concatenate((xy, xy + rng.uniform(20, 150, size=(300, 2)), rng.rand(300, 1)), axis=1)
+    trks = dets[rng.permutation(300)[:250]]
+    trks[:, :4] += rng.normal(0, 10, size=(250, 4))
+    dense, sparse = AssociationContext(dets, trks), AssociationContext(dets, trks, sparse=True)
+    np.testing.assert_array_equal(sparse.iou, dense.iou)
+    for threshold in (0.0, 0.3, 0.7):
+        np.testing.assert_array_equal(sparse.candidate_pairs(threshold), dense.candidate_pairs(threshold))
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from trackers.integrated_ocsort_embedding.batchkalman import BatchKalmanFilter
+from trackers.integrated_ocsort_embedding.kalmanfilter import KalmanFilterNew
+
+
+def make_filters(new_kf, n, rng):
+    bank = BatchKalmanFilter.box_filter(new_kf, capacity=2)
+    x = rng.uniform(1, 100, size=(n, bank.dim_x))
+    P = np.repeat(np.eye(bank.dim_x)[np.newaxis] * 10, n, axis=0) + rng.uniform(0, 1, size=(n, 1, 1))
+    bank.add(x, P)
+    refs = []
+    for row in range(n):
+        ref = KalmanFilterNew(dim_x=bank.dim_x, dim_z=bank.dim_z)
+        ref.F, ref.H, ref.Q, ref.R = bank.F.copy(), bank.H.copy(), bank.Q.copy(), bank.R.copy()
+        ref.x = x[row, :, np.newaxis].copy()
+        ref.P = P[row].copy()
+        refs.append(ref)
+    return bank, refs
+
+
+@pytest.mark.parametrize("new_kf", [False, True])
+def test_predict_update(new_kf):
+    rng = np.random.RandomState(0)
+    n = 10
+    bank, refs = make_filters(new_kf, n, rng)
+    for step in range(20):
+        # All the rows, or a subset with per-row noise
+        if step % 2:
+            idx = np.flatnonzero(rng.rand(n) < 0.5)
+            Q = rng.uniform(0.5, 2, size=(len(idx), 1, 1)) * np.eye(bank.dim_x)
+            R = rng.uniform(0.5, 2, size=(len(idx), 1, 1)) * np.eye(bank.dim_z)
+        else:
+            idx, Q, R = np.arange(n), None, None
+        bank.predict(None if Q is None else idx, Q)
+        z = rng.uniform(1, 100, size=(len(idx), bank.dim_z))
+        bank.update(idx, z, R)
+        for k, row in enumerate(idx):
+            refs[row].predict(Q=None if Q is None else Q[k])
+            refs[row].update(z[k, :, np.newaxis], R=None if R is None else R[k], new_kf=new_kf)
+        for row, ref in enumerate(refs):
+            np.testing.assert_allclose(bank.x[row], ref.x[:, 0], rtol=1e-12, atol=1e-9)
+            np.testing.assert_allclose(bank.P[row], ref.P, rtol=1e-12, atol=1e-9)
+
+
+def test_keep_and_grow():
+    rng = np.random.RandomState(1)
+    bank, _ = make_filters(False, 5, rng)
+    x = bank.x.copy()
+    mask = np.array([True, False, True, True, False])
+    bank.keep(mask)
+    bank.add(np.ones((4, bank.dim_x)), np.repeat(np.eye(bank.dim_x)[np.newaxis], 4, axis=0))
+    assert len(bank) == 7
+    np.testing.assert_array_equal(bank.x[:3], x[mask])
+    np.testing.assert_array_equal(bank.x[3:], 1)
@@ -0,0 +1,78 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from trackers.integrated_ocsort_embedding import cmc
+from trackers.integrated_ocsort_embedding.framecache import FrameArrayCache
+
+from .scene import IMG_NUMPY, IMG_TENSOR, make_scene, make_tracker
+
+
+def write_gmc(path, affines):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fp:
+        for f, A in enumerate(affines):
+            fp.write("\t".join([str(f)] + [f"{v:.6f}" for v in A.ravel()]) + "\t\n")
+
+
+@pytest.fixture
+def gmc_root(tmp_path, monkeypatch):
+    """A ./cache/cmc_files tree with one DanceTrack sequence, in a fresh working directory."""
+    monkeypatch.chdir(tmp_path)
+    root = tmp_path / "cache" / "cmc_files"
+    for folder in ("DanceTrack", "MOT17_ablation", "MOT20_ablation", "MOTChallenge"):
+        os.makedirs(root / folder)
+    rng = np.random.RandomState(0)
+    affines = np.round(np.eye(2, 3) + rng.normal(0, 0.01, size=(5, 2, 3)), 6)
+    write_gmc(str(root / "DanceTrack" / "GMC-dancetrack-0001.txt"), affines)
+    return root, affines
+
+
+def test_compile(gmc_root):
+    root, affines = gmc_root
+    store = cmc.compile_cmc_files(str(root), "./cache/compiled")
+    np.testing.assert_array_equal(store.get("dancetrack0001"), affines)
+    assert sorted(os.listdir("./cache")) == ["cmc_files", "compiled"]
+
+
+def test_parallel_compiles(gmc_root):
+    # Every run ends up with a complete store, no temporary folder is left
+    root, affines = gmc_root
+    threads = [
+        threading.Thread(target=cmc.compile_cmc_files, args=(str(root), "./cache/compiled", False)) for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    np.testing.assert_array_equal(FrameArrayCache("./cache/compiled").get("dancetrack0001"), affines)
+    assert sorted(os.listdir("./cache")) == ["cmc_files", "compiled"]
+
+
+def test_uncompiled_sequence(gmc_root):
+    root, affines = gmc_root
+    cmc.compile_cmc_files(str(root), cmc.CMC_STORE)
+    index = open(os.path.join(cmc.CMC_STORE, "index.txt")).read()
+    # Added after the compilation: read from its text file, the store is left alone
+    write_gmc(str(root / "DanceTrack" / "GMC-dancetrack-0002.txt"), affines[::-1])
+    computer = cmc.CMCComputer(method="file")
+    for f in range(len(affines)):
+        A = computer.compute_affine(None, np.empty((0, 4)), f"dancetrack0002:{f + 1}")
+        np.testing.assert_array_equal(A, affines[-1 - f])
+    assert open(os.path.join(cmc.CMC_STORE, "index.txt")).read() == index
+    with pytest.raises(RuntimeError):
+        computer.compute_affine(None, np.empty((0, 4)), "dancetrack0003:1")
+
+
+def test_close_stops_the_worker():
+    frames, embs = make_scene(0, n_frames=20)
+    before = threading.active_count()
+    tracker = make_tracker(frames, embs, cmc_async=True)
+    for f, (dets, ids) in enumerate(frames):
+        tracker.start_cmc(None, f"scene:{f + 1}")
+        tracker.update(dets.copy(), IMG_TENSOR, IMG_NUMPY, f"scene:{f + 1}")
+    assert threading.active_count() == before + 1
+    tracker.close()
+    assert threading.active_count() == before
@@ -0,0 +1,31 @@
+import os
+import pickle
+
+import numpy as np
+import torch
+
+from external.adaptors.detector import Detector
+
+
+def test_convert_over_stale_tmp(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open("weights.pth", "wb") as fp:
+        fp.write(b"weights")
+    cache_path = Detector("yolox", "weights.pth", "mot17").cache_path
+    # An interrupted conversion left a partial sequence behind
+    os.makedirs(os.path.join(cache_path + ".tmp", "a"))
+    with open(os.path.join(cache_path + ".tmp", "a", "rows.bin"), "wb") as fp:
+        fp.write(b"partial")
+
+    # The former whole-dataset pickle of the detections
+    rng = np.random.RandomState(0)
+    outputs = {f"{seq}:{f}": rng.rand(3, 5).astype(np.float32) for seq in ("a", "b") for f in (1, 2)}
+    with open("./cache/det_weights.pkl", "wb") as fp:
+        pickle.dump({tag: torch.from_numpy(rows) for tag, rows in outputs.items()}, fp)
+
+    detector = Detector("yolox", "weights.pth", "mot17")
+    assert not os.path.exists(cache_path + ".tmp")
+    for tag, rows in outputs.items():
+        # From the converted cache, the model is never loaded
+        np.testing.assert_array_equal(np.asarray(detector.forward(None, tag).numpy()), rows)
+    assert detector.model is None
@@ -0,0 +1,27 @@
+import pickle
+
+import numpy as np
+
+from trackers.integrated_ocsort_embedding.cachemanager import CACHE
+from trackers.integrated_ocsort_embedding.embedding import EmbeddingComputer
+
+
+def test_import_legacy_pickle(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    embedder = EmbeddingComputer("mot17", False, True)
+    # The former per-sequence pickle, one array per frame tag
+    rng = np.random.RandomState(0)
+    legacy = {f"legacy:{f}": rng.rand(3, 512).astype(np.float32) for f in (1, 2)}
+    with open(embedder.legacy_path.format("legacy"), "wb") as fp:
+        pickle.dump(legacy, fp)
+
+    img = np.zeros((720, 1280, 3), dtype=np.uint8)
+    bbox = np.array([[10.0, 20.0, 70.0, 180.0], [300.0, 50.0, 360.0, 210.0], [900.0, 400.0, 960.0, 560.0]])
+    for tag, embs in legacy.items():
+        np.testing.assert_array_equal(embedder.compute_embedding(img, bbox, tag), embs)
+    # From the pickle, the model is never loaded
+    assert embedder.model is None
+
+    # And into the new namespace of the sequence
+    CACHE.flush()
+    assert len(embedder.cache.store) == 6
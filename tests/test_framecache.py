@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+import pytest
+
+from trackers.integrated_ocsort_embedding import framecache
+from trackers.integrated_ocsort_embedding.framecache import FrameArrayCache
+
+
+def frames(rng, n, dim=4):
+    return {f"seq:{f + 1}": rng.rand(rng.randint(0, 4), dim).astype(np.float32) for f in range(n)}
+
+
+def test_interrupted_meta_write(tmp_path, monkeypatch):
+    folder = str(tmp_path / "store")
+    rows = np.ones((2, 4), dtype=np.float32)
+
+    def crash(src, dst):
+        raise OSError("crash")
+
+    # The crash happens before meta.json exists, the folder opens as empty
+    monkeypatch.setattr(framecache.os, "replace", crash)
+    with pytest.raises(OSError):
+        FrameArrayCache(folder).append("seq:1", rows)
+    monkeypatch.undo()
+    assert not os.path.exists(os.path.join(folder, "meta.json"))
+    store = FrameArrayCache(folder)
+    assert len(store) == 0
+    store.append("seq:1", rows)
+    np.testing.assert_array_equal(FrameArrayCache(folder).get("seq:1"), rows)
+
+
+def test_compact_in_chunks(tmp_path, monkeypatch):
+    rng = np.random.RandomState(0)
+    folder = str(tmp_path / "store")
+    store = FrameArrayCache(folder)
+    old, new = frames(rng, 30), frames(rng, 30)
+    for key, rows in old.items():
+        store.append(key, rows)
+    # Every frame appended again, half of the rows are dead
+    store.extend(list(new), list(new.values()))
+
+    # A few frames per write
+    monkeypatch.setattr(framecache, "COMPACT_CHUNK", 5 * store.row_size)
+    writes = []
+    extend = FrameArrayCache.extend
+
+    def counted_extend(self, keys, values):
+        writes.append(len(keys))
+        extend(self, keys, values)
+
+    monkeypatch.setattr(FrameArrayCache, "extend", counted_extend)
+    store = FrameArrayCache(folder)
+    assert len(writes) > 3 and sum(writes) == len(new)
+    assert store.n_rows == store.live_rows() == sum(len(rows) for rows in new.values())
+    for key, rows in new.items():
+        np.testing.assert_array_equal(store.get(key), rows)
@@ -0,0 +1,16 @@
+import numpy as np
+
+from trackers.integrated_ocsort_embedding.latency import IOU_ONLY
+
+from .scene import make_scene, make_tracker, run
+
+
+def test_iou_only_reference_costs():
+    # An unreachable frame rate leaves no crop budget: IoU + VDC only, with
+    # the adaptive weighting on and the reference (unfused) costs
+    frames, embs = make_scene(0)
+    tracker = make_tracker(frames, embs, cost_dtype=None, target_fps=1e9)
+    outputs = run(tracker, frames)
+    assert tracker.latency.counts[IOU_ONLY] > len(frames) // 2
+    assert all(out.shape[1] == 5 for out in outputs)
+    assert len(np.unique(np.concatenate(outputs)[:, 4])) > 0
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from trackers.integrated_ocsort_embedding import ocsort
+from trackers.integrated_ocsort_embedding.association import ambiguous_detections
+
+from .scene import make_scene, make_tracker, run
+
+
+def stable_scene(n_frames=40, dim=512):
+    # Two far apart pedestrians standing still: the detection jitter makes
+    # the gate's motion direction check reject most frames
+    rng = np.random.RandomState(0)
+    embs = rng.normal(size=(2, dim))
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    frames = []
+    for _ in range(n_frames):
+        x = np.array([100.0, 1000.0]) + rng.normal(0, 1.5, 2)
+        y = np.array([200.0, 500.0]) + rng.normal(0, 1.5, 2)
+        dets = np.stack((x, y, x + 60, y + 160, np.full(2, 0.9)), axis=1)
+        frames.append((dets, np.arange(2)))
+    return frames, embs
+
+
+def skip_rate(frames, embs, **kwargs):
+    tracker = make_tracker(frames, embs, **kwargs)
+    run(tracker, frames)
+    return tracker.embedding_reuse.skip_rate
+
+
+def test_budget_raises_skip_rate():
+    frames, embs = stable_scene()
+    gate = skip_rate(frames, embs)
+    budget = skip_rate(frames, embs, reid_budget=5)
+    assert budget > gate
+    # At least one refresh every budget + 1 frames
+    assert budget <= 5 / 6
+
+
+def test_scale_change_forces_refresh():
+    frames, embs = stable_scene()
+    for f, (dets, ids) in enumerate(frames):
+        # The boxes grow by 5% per frame
+        dets[:, 2:4] = dets[:, :2] + (dets[:, 2:4] - dets[:, :2]) * 1.05**f
+    assert skip_rate(frames, embs, reid_budget=5) < skip_rate(stable_scene()[0], embs, reid_budget=5)
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"lazy_embeddings": True}, {"lazy_embeddings": True, "min_visibility": 0.5}])
+def test_skipped_excludes_late_crops(kwargs):
+    frames, embs = make_scene(3)
+    tracker = make_tracker(frames, embs, **kwargs)
+    run(tracker, frames)
+    reuse = tracker.embedding_reuse
+    # Every detection not counted as skipped went to the model once
+    assert reuse.n_dets - reuse.n_reused == sum(tracker.crops)
+
+
+def separated_scene(n_frames=30, dim=512):
+    # Pedestrians 300 px apart walking side by side, never close to another
+    rng = np.random.RandomState(1)
+    embs = rng.normal(size=(5, dim))
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    frames = []
+    for f in range(n_frames):
+        x = 100.0 + 300 * np.arange(5) + 3 * f + rng.normal(0, 1, 5)
+        y = 300.0 + 2 * f + rng.normal(0, 1, 5)
+        dets = np.stack((x, y, x + 60, y + 160, np.full(5, 0.9)), axis=1)
+        frames.append((dets, np.arange(5)))
+    return frames, embs
+
+
+def watch_lazy(tracker, monkeypatch):
+    """The ambiguity masks and the embedded boxes of every frame, first round only."""
+    masks, embedded = {}, {}
+
+    def ambiguous(*args, **kwargs):
+        masks[tracker.frame_count] = ambiguous_detections(*args, **kwargs)
+        return masks[tracker.frame_count]
+
+    compute_embedding = tracker.embedder.compute_embedding
+
+    def watched(img, bboxes, tag):
+        if not tag.endswith(":late"):
+            embedded[tracker.frame_count] = bboxes.copy()
+        return compute_embedding(img, bboxes, tag)
+
+    monkeypatch.setattr(ocsort, "ambiguous_detections", ambiguous)
+    tracker.embedder.compute_embedding = watched
+    return masks, embedded
+
+
+def test_lazy_embeds_ambiguous_only(monkeypatch):
+    frames, embs = make_scene(4)
+    tracker = make_tracker(frames, embs, lazy_embeddings=True)
+    masks, embedded = watch_lazy(tracker, monkeypatch)
+    run(tracker, frames)
+    assert any(mask.any() for mask in masks.values())
+    for frame, mask in masks.items():
+        dets = frames[frame - 1][0]
+        # The detections as update rescales them
+        dets = dets[dets[:, 4] > tracker.det_thresh, :4] / (800 / 1080)
+        rows = [np.flatnonzero(np.all(np.isclose(dets, box), axis=1))[0] for box in embedded.get(frame, [])]
+        assert mask[rows].all()
+
+    full = make_tracker(frames, embs)
+    run(full, frames)
+    assert sum(tracker.crops) < sum(full.crops)
+
+
+def test_lazy_same_associations():
+    frames, embs = separated_scene()
+    lazy = make_tracker(frames, embs, lazy_embeddings=True)
+    full = make_tracker(frames, embs)
+    for a, b in zip(run(lazy, frames), run(full, frames)):
+        np.testing.assert_array_equal(a, b)
+    # Only the first frame is embedded, before there are tracks
+    assert lazy.crops == [5]
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from trackers.integrated_ocsort_embedding.ocsort import KalmanBoxTracker, k_previous_obs
+from trackers.integrated_ocsort_embedding.trackstore import TrackStore
+
+
+def random_boxes(rng, n):
+    xy = rng.uniform(0, 1500, size=(n, 2))
+    wh = rng.uniform([30, 80], [90, 220], size=(n, 2))
+    return np.concatenate((xy, xy + wh, rng.uniform(0.5, 1, size=(n, 1))), axis=1)
+
+
+def drive(new_kf, n_frames=30, n_tracks=8, p_miss=0.0, affine_std=None, seed=0, delta_t=3):
+    """
+    Runs the same predict / update / miss (and CMC warp) sequence on a
+    TrackStore and on one KalmanBoxTracker per track, checking that they
+    agree after every frame.
+    """
+    rng = np.random.RandomState(seed)
+    boxes = random_boxes(rng, n_tracks)
+    velocity = rng.normal(0, 3, size=(n_tracks, 2))
+    embs = np.zeros((n_tracks, 1))
+    store = TrackStore(delta_t=delta_t, new_kf=new_kf)
+    store.add(boxes, embs)
+    refs = [KalmanBoxTracker(box, delta_t=delta_t, new_kf=new_kf) for box in boxes]
+    for f in range(n_frames):
+        if affine_std is not None:
+            th = rng.normal(0, affine_std)
+            affine = np.array(
+                [[np.cos(th), -np.sin(th), rng.normal(0, 3)], [np.sin(th), np.cos(th), rng.normal(0, 3)]]
+            )
+            store.apply_affine_correction(affine)
+            for ref in refs:
+                ref.apply_affine_correction(affine)
+        pos = store.predict()
+        for row, ref in enumerate(refs):
+            np.testing.assert_allclose(pos[row], ref.predict()[0], rtol=1e-12, atol=1e-9)
+
+        boxes[:, :4] += np.tile(velocity, 2) + rng.normal(0, 1, size=(n_tracks, 4))
+        observed = rng.rand(n_tracks) >= p_miss
+        rows = np.flatnonzero(observed)
+        store.update(rows, boxes[rows].copy())
+        store.mark_missed(np.flatnonzero(~observed))
+        for row, ref in enumerate(refs):
+            ref.update(boxes[row].copy() if observed[row] else None)
+        check(store, refs, delta_t)
+    return store, refs
+
+
+def check(store, refs, delta_t):
+    for row, ref in enumerate(refs):
+        np.testing.assert_allclose(store.x[row], ref.kf.x[:, 0], rtol=1e-12, atol=1e-9)
+        np.testing.assert_allclose(store.P[row], ref.kf.P, rtol=1e-12, atol=1e-9)
+        np.testing.assert_allclose(store.last_obs[row], ref.last_observation, rtol=1e-12, atol=1e-9)
+        assert store.time_since_update[row] == ref.time_since_update
+        assert store.hit_streak[row] == ref.hit_streak
+        assert store.frozen[row] == ref.frozen
+        if ref.velocity is not None:
+            np.testing.assert_allclose(store.velocity[row], ref.velocity, rtol=1e-12, atol=1e-9)
+    previous = np.array([k_previous_obs(ref.observations, ref.age, delta_t) for ref in refs])
+    np.testing.assert_allclose(store.k_previous_obs(), previous, rtol=1e-12, atol=1e-9)
+
+
+@pytest.mark.parametrize("new_kf", [False, True])
+def test_predict_update(new_kf):
+    drive(new_kf)
+
+
+@pytest.mark.parametrize("new_kf", [False, True])
+def test_oru(new_kf):
+    # Tracks lost for a few frames are re-updated along the virtual trajectory
+    store, refs = drive(new_kf, n_frames=60, p_miss=0.3, seed=1)
+    assert not store.kf.has_saved.all()
+
+
+@pytest.mark.parametrize("delta_t", [1, 3])
+def test_bounded_history(delta_t):
+    # The reference keeps every observation, the store delta_t + 1 of them
+    store, refs = drive(True, n_frames=200, p_miss=0.2, seed=3, delta_t=delta_t)
+    assert store.obs_buf.shape[1] == delta_t + 1
+    assert min(len(ref.observations) for ref in refs) > 100
+
+
+@pytest.mark.parametrize("new_kf", [False, True])
+def test_affine_correction(new_kf):
+    # The batched warp of the states, the observations and the saved ORU
+    # states of the frozen tracks against the per-track correction
+    drive(new_kf, n_frames=40, p_miss=0.3, affine_std=0.01, seed=2)
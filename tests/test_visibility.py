@@ -0,0 +1,54 @@
+import numpy as np
+
+from trackers.integrated_ocsort_embedding.visibility import CropSuppression, visible_fraction
+
+from .scene import IMG_NUMPY, IMG_TENSOR, make_tracker
+
+
+def test_no_occluders():
+    boxes = np.array([[0.0, 0.0, 50.0, 100.0], [100.0, 0.0, 150.0, 120.0], [300.0, 50.0, 340.0, 150.0]])
+    np.testing.assert_array_equal(visible_fraction(boxes), 1)
+    assert len(visible_fraction(np.empty((0, 4)))) == 0
+
+
+def test_full_occlusion():
+    # The small box is behind the large one, which is not hidden by it
+    boxes = np.array([[10.0, 10.0, 40.0, 60.0], [0.0, 0.0, 100.0, 200.0]])
+    np.testing.assert_array_equal(visible_fraction(boxes), [0, 1])
+
+
+def test_partial_occlusion():
+    # The sample points of the back box are at x = 5, 15, ..., 75
+    back = [0.0, 0.0, 80.0, 80.0]
+    for x2, visible in ((44.9, 0.5), (45.0, 0.375), (5.0, 0.875), (4.9, 1.0)):
+        boxes = np.array([back, [-10.0, -10.0, x2, 100.0]])
+        assert visible_fraction(boxes)[0] == visible
+
+
+def test_suppress():
+    dets = np.array([[10.0, 10.0, 40.0, 60.0, 0.9], [0.0, 0.0, 100.0, 200.0, 0.9]])
+    suppression = CropSuppression(0.5)
+    occluded, visibility = suppression.suppress(dets, np.array([True, True]))
+    np.testing.assert_array_equal(occluded, [True, False])
+    np.testing.assert_array_equal(visibility, [0, 1])
+    assert suppression.saved == 1
+    # Not counted when it was not going to be embedded anyway
+    occluded, _ = suppression.suppress(dets, np.array([False, True]))
+    assert not occluded.any() and suppression.saved == 1
+    # Off by default
+    occluded, visibility = CropSuppression().suppress(dets, np.array([True, True]))
+    assert not occluded.any() and np.all(visibility == 1)
+
+
+def test_saved_after_late_embedding():
+    # A pedestrian half hidden behind another one, standing still
+    dets = np.array([[100.0, 100.0, 160.0, 260.0, 0.9], [130.0, 120.0, 190.0, 300.0, 0.9]])
+    frames = [(dets, np.arange(2))] * 3
+    tracker = make_tracker(frames, np.eye(2, 512), min_visibility=0.6)
+    tracker.update(dets.copy(), IMG_TENSOR, IMG_NUMPY, "scene:1")
+    # Suppressed, then embedded anyway for its new track
+    assert tracker.crop_suppression.saved == 0 and tracker.crops == [1, 1]
+    for f in (2, 3):
+        tracker.update(dets.copy(), IMG_TENSOR, IMG_NUMPY, f"scene:{f}")
+    # Then it keeps the embedding of its track
+    assert tracker.crop_suppression.saved == 2 and sum(tracker.crops) == 4
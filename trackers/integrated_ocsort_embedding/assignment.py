@@ -0,0 +1,249 @@
+"""
+    Linear assignment solvers.
+
+    Every solver is called with a (n, m) cost matrix and returns the (k, 2)
+    array of matched [row, col] sorted by row, k = min(n, m), i.e. the
+    rectangular problem is solved as if padded with zeros. The solver is
+    chosen once with get_solver, usually when the tracker is built, instead
+    of probing the lap package on every call.
+
+    warm_start is an optional (m,) array of column prices (dual variables)
+    from a previous solve, e.g. the prices of the tracks in the previous
+    frame. The solvers that can use it (`warm_start` True) start from it and
+    expose the prices they end with in `prices`, the others ignore it and
+    leave `prices` None.
+"""
+import os
+
+import numpy as np
+
+
+class LapjvSolver(object):
+    """Jonker-Volgenant, exact, from the lap package."""
+
+    name = "lapjv"
+    warm_start = False
+
+    def __init__(self):
+        import lap
+
+        self._lapjv = lap.lapjv
+        self.prices = None
+
+    def __call__(self, cost_matrix, warm_start=None):
+        if cost_matrix.size == 0:
+            return np.empty((0, 2), dtype=int)
+        _, x, _ = self._lapjv(cost_matrix, extend_cost=True)
+        rows = np.flatnonzero(x >= 0)
+        return np.stack((rows, x[rows]), axis=1)
+
+
+class ScipySolver(object):
+    """scipy.optimize.linear_sum_assignment, exact."""
+
+    name = "scipy"
+    warm_start = False
+
+    def __init__(self):
+        from scipy.optimize import linear_sum_assignment
+
+        self._solve = linear_sum_assignment
+        self.prices = None
+
+    def __call__(self, cost_matrix, warm_start=None):
+        if cost_matrix.size == 0:
+            return np.empty((0, 2), dtype=int)
+        x, y = self._solve(cost_matrix)
+        return np.stack((x, y), axis=1)
+
+
+class AuctionSolver(object):
+    """
+    Forward auction of Bertsekas with eps-scaling, all the unassigned rows
+    bid at once (Jacobi variant) so that every round is a few array
+    operations. The total cost is within min(n, m) * eps_end of the optimum.
+
+    With a warm start the scaling starts at warm_eps from the given prices
+    instead of at a fraction of the cost range from zero prices. It only
+    pays off when the prices are close to the final ones, see
+    benchmarks/bench_lap.py.
+    """
+
+    name = "auction"
+    warm_start = True
+
+    def __init__(self, eps_end=1e-4, warm_eps=0.03, scaling=8.0):
+        self.eps_end = eps_end
+        self.warm_eps = warm_eps
+        self.scaling = scaling
+        self.prices = None
+
+    def __call__(self, cost_matrix, warm_start=None):
+        self.prices = None
+        n, m = cost_matrix.shape
+        if n == 0 or m == 0:
+            return np.empty((0, 2), dtype=int)
+        transpose = n > m
+        benefit = -(cost_matrix.T if transpose else cost_matrix)
+        k = max(n, m)
+        # Padded to a square problem with zero benefit, as extend_cost
+        square = np.zeros((k, k))
+        square[: benefit.shape[0], : benefit.shape[1]] = benefit
+
+        prices = np.zeros(k)
+        span = square.max() - square.min()
+        eps = max(span / self.scaling, self.eps_end)
+        if warm_start is not None and not transpose:
+            prices[:m] = warm_start
+            eps = max(min(eps, self.warm_eps), self.eps_end)
+
+        while True:
+            assign = self._auction(square, prices, eps)
+            if eps <= self.eps_end:
+                break
+            eps = max(eps / self.scaling, self.eps_end)
+
+        if not transpose:
+            self.prices = prices[:m].copy()
+        rows = np.arange(benefit.shape[0])
+        cols = assign[rows]
+        keep = cols < benefit.shape[1]
+        pairs = np.stack((rows[keep], cols[keep]), axis=1)
+        if transpose:
+            pairs = pairs[:, ::-1]
+            pairs = pairs[np.argsort(pairs[:, 0], kind="stable")]
+        return pairs
+
+    @staticmethod
+    def _auction(benefit, prices, eps):
+        """One eps phase, prices are updated in place. Returns col of each row."""
+        k = benefit.shape[0]
+        assign = np.full(k, -1)
+        owner = np.full(k, -1)
+        while True:
+            bidders = np.flatnonzero(assign < 0)
+            if len(bidders) == 0:
+                return assign
+            values = benefit[bidders] - prices
+            rng = np.arange(len(bidders))
+            best = np.argmax(values, axis=1)
+            v1 = values[rng, best]
+            if k > 1:
+                values[rng, best] = -np.inf
+                v2 = values.max(axis=1)
+            else:
+                v2 = v1
+            bids = prices[best] + (v1 - v2) + eps
+
+            # Each column goes to its highest bidder, the previous owner is out
+            order = np.lexsort((-bids, best))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = best[order][1:] != best[order][:-1]
+            win = order[first]
+            cols = best[win]
+            outbid = owner[cols]
+            assign[outbid[outbid >= 0]] = -1
+            owner[cols] = bidders[win]
+            assign[bidders[win]] = cols
+            prices[cols] = bids[win]
+
+
+class GreedySolver(object):
+    """
+    Greedy matching: repeatedly takes the cheapest pair whose row and column
+    are both free. Done in rounds, each one takes all the pairs that are the
+    cheapest of both their row and their column among the free ones, which
+    gives the same matching as the sequential greedy without ties.
+
+    Quality bound: with benefits w = -cost >= 0 (the association costs are
+    negated similarities), the total benefit is at least half of the optimal
+    one (greedy is a 1/2-approximation of maximum weight matching). It is
+    exact when every row and column has a distinct best pair, the usual case
+    for well separated objects.
+    """
+
+    name = "greedy"
+    warm_start = False
+
+    def __init__(self):
+        self.prices = None
+
+    def __call__(self, cost_matrix, warm_start=None):
+        n, m = cost_matrix.shape
+        if n == 0 or m == 0:
+            return np.empty((0, 2), dtype=int)
+        cost = np.array(cost_matrix, dtype=float)
+        # The NaN pairs are never taken, as the infinite ones
+        cost[np.isnan(cost)] = np.inf
+        matches = []
+        while len(matches) < min(n, m):
+            best_col = np.argmin(cost, axis=1)
+            best_row = np.argmin(cost, axis=0)
+            rows = np.flatnonzero((best_row[best_col] == np.arange(n)) & np.isfinite(cost[np.arange(n), best_col]))
+            if len(rows) == 0:
+                # Only infinite pairs left
+                break
+            cols = best_col[rows]
+            matches.extend(zip(rows, cols))
+            cost[rows, :] = np.inf
+            cost[:, cols] = np.inf
+        matches = np.array(matches, dtype=int).reshape(-1, 2)
+        return matches[np.argsort(matches[:, 0], kind="stable")]
+
+
+LAP_SOLVERS = {
+    "lapjv": LapjvSolver,
+    "scipy": ScipySolver,
+    "auction": AuctionSolver,
+    "greedy": GreedySolver,
+}
+
+
+class RecordingSolver(object):
+    """Wraps a solver and saves every cost matrix it gets, for benchmarks."""
+
+    def __init__(self, solver, folder):
+        self.solver = solver
+        self.name = solver.name
+        self.warm_start = solver.warm_start
+        self.folder = folder
+        self.count = 0
+        os.makedirs(folder, exist_ok=True)
+
+    @property
+    def prices(self):
+        return self.solver.prices
+
+    @prices.setter
+    def prices(self, value):
+        self.solver.prices = value
+
+    def __call__(self, cost_matrix, warm_start=None):
+        np.save(os.path.join(self.folder, f"{self.count:07d}.npy"), cost_matrix)
+        self.count += 1
+        return self.solver(cost_matrix, warm_start)
+
+
+def get_solver(name="auto", dump_folder=None):
+    """
+    The solver registered under name. "auto" is lapjv when the lap package
+    is installed, else scipy. With dump_folder the cost matrices are saved
+    there, see benchmarks/bench_lap.py.
+
+    Only the auction solver uses the warm start, and only when the cost has
+    no more rows than columns: a transposed problem starts from zero prices
+    and leaves `prices` None.
+    """
+    if name == "auto":
+        try:
+            solver = LapjvSolver()
+        except ImportError:
+            print("Warning: lap is not installed, using scipy for the linear assignment")
+            solver = ScipySolver()
+    elif name in LAP_SOLVERS:
+        solver = LAP_SOLVERS[name]()
+    else:
+        raise ValueError(f"Unknown linear assignment solver {name}, choose from {', '.join(LAP_SOLVERS)}")
+    if dump_folder is not None:
+        solver = RecordingSolver(solver, dump_folder)
+    return solver
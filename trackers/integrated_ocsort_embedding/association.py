@@ -1,5 +1,7 @@
 import numpy as np
-import scipy.spatial as sp
+
+from .assignment import get_solver
+from .gating import iou_pairs, overlap_pairs, sparse_linear_assignment
 
 
 def iou_batch(bboxes1, bboxes2):
@@ -244,6 +246,53 @@ def aiou_batch(bboxes1, bboxes2):
 
     return iou, alpha
 
+
+class AssociationContext(object):
+    """
+    IoU and aspect ratio terms of the detections and the predicted tracks of
+    a frame, computed once and shared by the embedding skip gate and the
+    first round of association (dense or gated). iou and alpha are the same
+    as aiou_batch(detections, trackers).
+
+    With sparse, the IoU is only computed for the overlapping pairs found by
+    overlap_pairs, the others are 0 as in iou_batch, and candidate_pairs
+    reuses these pairs.
+    """
+
+    def __init__(self, detections, trackers, sparse=False):
+        self.detections = detections
+        self.trackers = trackers
+        self.pairs = None
+        if sparse:
+            d, t = self.pairs = overlap_pairs(detections, trackers)
+            self.iou = np.zeros((len(detections), len(trackers)))
+            self.iou[d, t] = iou_pairs(detections[d], trackers[t])
+        else:
+            self.iou = iou_batch(detections, trackers)
+        self._alpha = None
+
+    @property
+    def alpha(self):
+        if self._alpha is None:
+            d = self.detections
+            t = self.trackers
+            # One arctan per box instead of per pair
+            aspect_ratio = np.arctan((d[:, 2] - d[:, 0]) / (d[:, 3] - d[:, 1]))
+            candidates_aspect_ratio = np.arctan((t[:, 2] - t[:, 0]) / (t[:, 3] - t[:, 1]))
+            arctan = aspect_ratio[:, np.newaxis] - candidates_aspect_ratio[np.newaxis]
+            v = 1 - ((4 / np.pi**2) * arctan**2)
+            self._alpha = v / (1 - self.iou + v)
+        return self._alpha
+
+    def candidate_pairs(self, iou_threshold):
+        """The overlapping pairs with an IoU of at least iou_threshold, as overlap_pairs orders them."""
+        if self.pairs is None:
+            return np.nonzero((self.iou > 0) & (self.iou >= iou_threshold))
+        d, t = self.pairs
+        keep = self.iou[d, t] >= iou_threshold
+        return d[keep], t[keep]
+
+
 def ct_dist(bboxes1, bboxes2):
     """
     Measure the center distance between two sets of bounding boxes,
@@ -280,17 +329,75 @@ def speed_direction_batch(dets, tracks):
     return dy, dx  # size: num_track x num_det
 
 
-def linear_assignment(cost_matrix):
-    try:
-        import lap
+def speed_direction_pairs(dets, tracks):
+    """speed_direction_batch of the row-aligned pairs only."""
+    CX1, CY1 = (dets[:, 0] + dets[:, 2]) / 2.0, (dets[:, 1] + dets[:, 3]) / 2.0
+    CX2, CY2 = (tracks[:, 0] + tracks[:, 2]) / 2.0, (tracks[:, 1] + tracks[:, 3]) / 2.0
+    dx = CX1 - CX2
+    dy = CY1 - CY2
+    norm = np.sqrt(dx**2 + dy**2) + 1e-6
+    dx = dx / norm
+    dy = dy / norm
+    return dy, dx
+
+
+_default_solver = None
 
-        _, x, y = lap.lapjv(cost_matrix, extend_cost=True)
-        return np.array([[y[i], i] for i in x if i >= 0])  #
-    except ImportError:
-        from scipy.optimize import linear_sum_assignment
 
-        x, y = linear_sum_assignment(cost_matrix)
-        return np.array(list(zip(x, y)))
+def linear_assignment(cost_matrix, warm_start=None):
+    """Solves with the default solver of get_solver, looked up on the first call."""
+    global _default_solver
+    if _default_solver is None:
+        _default_solver = get_solver("auto")
+    return _default_solver(cost_matrix, warm_start)
+
+
+def component_assignment(cost_matrix, adjacency, solver=linear_assignment):
+    """
+    linear_assignment solved separately on each connected component of the
+    bipartite graph of the True entries of adjacency. Components with a
+    single row or column are matched directly, each of the others is passed
+    to solver, and the rows and columns without any edge are left unmatched.
+    Returns the (k, 2) matched [row, col] sorted by row.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    n, m = adjacency.shape
+    rows, cols = np.nonzero(adjacency)
+    if len(rows) == 0:
+        return np.empty((0, 2), dtype=int)
+
+    graph = coo_matrix((np.ones(len(rows)), (rows, n + cols)), shape=(n + m, n + m))
+    n_components, labels = connected_components(graph, directed=False)
+    row_labels, col_labels = labels[:n], labels[n:]
+    row_sizes = np.bincount(row_labels, minlength=n_components)
+    col_sizes = np.bincount(col_labels, minlength=n_components)
+
+    # A component with a single row (column) is solved by the best column
+    # (row) of that row (column), for all of them at once
+    labels = row_labels[rows]
+    star = (row_sizes[labels] == 1) | (col_sizes[labels] == 1)
+    order = np.lexsort((cost_matrix[rows, cols], labels))
+    order = order[star[order]]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = labels[order][1:] != labels[order][:-1]
+    matches = [np.stack((rows[order[first]], cols[order[first]]), axis=1)]
+
+    # The rows and columns of each remaining component, grouped by label
+    rest = np.unique(labels[~star])
+    row_order = np.argsort(row_labels, kind="stable")
+    col_order = np.argsort(col_labels, kind="stable")
+    row_start = np.searchsorted(row_labels[row_order], rest)
+    col_start = np.searchsorted(col_labels[col_order], rest)
+
+    for label, i, j in zip(rest, row_start, col_start):
+        comp_rows = row_order[i : i + row_sizes[label]]
+        comp_cols = col_order[j : j + col_sizes[label]]
+        sub = solver(cost_matrix[np.ix_(comp_rows, comp_cols)])
+        matches.append(np.stack((comp_rows[sub[:, 0]], comp_cols[sub[:, 1]]), axis=1))
+    matches = np.concatenate(matches, axis=0)
+    return matches[np.argsort(matches[:, 0], kind="stable")]
 
 
 def associate_detections_to_trackers(detections, trackers, iou_threshold=0.3):
@@ -341,50 +448,100 @@ def associate_detections_to_trackers(detections, trackers, iou_threshold=0.3):
     return matches, np.array(unmatched_detections), np.array(unmatched_trackers)
 
 
+def top2_gap(x, axis):
+    """Difference between the largest and the second largest value along axis."""
+    x = np.moveaxis(x, axis, -1)
+    rows = np.arange(x.shape[0])
+    best = np.argmax(x, axis=1)
+    top1 = x[rows, best]
+    # Partial selection: knock out the maximum instead of sorting
+    x = x.copy()
+    x[rows, best] = -np.inf
+    return top1 - np.max(x, axis=1)
+
+
 def compute_aw_new_metric(emb_cost, w_association_emb, max_diff=0.5):
     w_emb = np.full_like(emb_cost, w_association_emb)
     w_emb_bonus = np.full_like(emb_cost, 0)
 
     # Needs two columns at least to make sense to boost
     if emb_cost.shape[1] >= 2:
-        # Across all rows
-        for idx in range(emb_cost.shape[0]):
-            inds = np.argsort(-emb_cost[idx])
-            # Row weight is difference between top / second top
-            row_weight = min(emb_cost[idx, inds[0]] - emb_cost[idx, inds[1]], max_diff)
-            # Add to row
-            w_emb_bonus[idx] += row_weight / 2
+        # Row weight is difference between top / second top
+        row_weight = np.minimum(top2_gap(emb_cost, 1), max_diff)
+        # Add to row
+        w_emb_bonus += (row_weight / 2)[:, np.newaxis]
 
     if emb_cost.shape[0] >= 2:
-        for idj in range(emb_cost.shape[1]):
-            inds = np.argsort(-emb_cost[:, idj])
-            col_weight = min(emb_cost[inds[0], idj] - emb_cost[inds[1], idj], max_diff)
-            w_emb_bonus[:, idj] += col_weight / 2
+        col_weight = np.minimum(top2_gap(emb_cost, 0), max_diff)
+        w_emb_bonus += (col_weight / 2)[np.newaxis, :]
 
     return w_emb + w_emb_bonus
 
 
 def split_cosine_dist(dets, trks, affinity_thresh=0.55, pair_diff_thresh=0.6, hard_thresh=True):
+    """
+    Similarity of the (N, P, D) grid embeddings of the detections to the
+    (M, P, D) ones of the tracks. Each track patch takes its best match among
+    the detection patches; the pair similarity is the best of these.
 
-    cos_dist = np.zeros((len(dets), len(trks)))
+    The patch similarities of all the pairs come from one matrix product of
+    the normalized (N * P, D) and (M * P, D) embeddings.
+    """
+    dets = np.asarray(dets, dtype=float)
+    trks = np.asarray(trks, dtype=float)
+    if len(dets) == 0 or len(trks) == 0:
+        return np.zeros((len(dets), len(trks)))
+
+    n, p = dets.shape[:2]
+    m, q = trks.shape[:2]
+    # The zero embeddings of the detections that were not embedded have a zero similarity
+    dets = dets / np.maximum(np.linalg.norm(dets, axis=-1, keepdims=True), 1e-12)
+    trks = trks / np.linalg.norm(trks, axis=-1, keepdims=True)
+    cos_d = (dets.reshape(n * p, -1) @ trks.reshape(m * q, -1).T).reshape(n, p, m, q)
+    patch_affinity = np.max(cos_d, axis=1)  ## shape = [N, M, 3]
+    cos_dist = np.max(patch_affinity, axis=2)  # can experiment with mean too (max works slightly better)
+    # exp16 - Using Hard threshold
+    if hard_thresh:
+        cos_dist[~np.all(patch_affinity > affinity_thresh, axis=2)] = 0
 
-    for i in range(len(dets)):
-        for j in range(len(trks)):
+    return cos_dist
 
-            cos_d = 1 - sp.distance.cdist(dets[i], trks[j], "cosine")  ## shape = 3x3
-            patch_affinity = np.max(cos_d, axis=0)  ## shape = [3,]
-            # exp16 - Using Hard threshold
-            if hard_thresh:
-                if len(np.where(patch_affinity > affinity_thresh)[0]) != len(patch_affinity):
-                    cos_dist[i, j] = 0
-                else:
-                    cos_dist[i, j] = np.max(patch_affinity)
-            else:
-                cos_dist[i, j] = np.max(patch_affinity)  # can experiment with mean too (max works slightly better)
 
+def split_cosine_dist_pairs(dets, trks, affinity_thresh=0.55, hard_thresh=True):
+    """split_cosine_dist of the row-aligned (K, P, D) and (K, Q, D) pairs, (K,)."""
+    dets = dets / np.maximum(np.linalg.norm(dets, axis=-1, keepdims=True), 1e-12)
+    trks = trks / np.linalg.norm(trks, axis=-1, keepdims=True)
+    patch_affinity = np.max(dets @ np.swapaxes(trks, 1, 2), axis=1)
+    cos_dist = np.max(patch_affinity, axis=1)
+    if hard_thresh:
+        cos_dist[~np.all(patch_affinity > affinity_thresh, axis=1)] = 0
     return cos_dist
 
 
+def ambiguous_detections(iou_matrix, score, iou_threshold, margin=0.2, band=0.05):
+    """
+    Detections whose first round match could depend on their embedding,
+    given the (N, M) IoU and appearance-free score (IoU + VDC) of the pairs.
+    The candidates of a detection are the tracks above iou_threshold - band,
+    a detection is ambiguous when it has several candidates whose score is
+    within margin of its best one, when it competes in the same way with
+    another detection for a track, or when one of its IoUs is within band
+    of iou_threshold. The other detections get the same match with or
+    without embedding unless the appearance cost outweighs the margin.
+    """
+    n, m = iou_matrix.shape
+    if n == 0 or m == 0:
+        return np.zeros(n, dtype=bool)
+    candidate = iou_matrix > iou_threshold - band
+    s = np.where(candidate, score, -np.inf)
+    row_close = candidate & (s >= s.max(axis=1, keepdims=True) - margin)
+    col_close = candidate & (s >= s.max(axis=0, keepdims=True) - margin)
+    ambiguous = row_close.sum(axis=1) >= 2
+    ambiguous |= (col_close & (col_close.sum(axis=0) >= 2)).any(axis=1)
+    ambiguous |= (np.abs(iou_matrix - iou_threshold) < band).any(axis=1)
+    return ambiguous
+
+
 def associate(
     detections,
     trackers,
@@ -399,6 +556,12 @@ def associate(
     aw_param,
     emb_off,
     grid_off,
+    approx_gating=False,
+    decompose=False,
+    solver=linear_assignment,
+    warm_start=None,
+    cost_builder=None,
+    context=None,
 ):
     if len(trackers) == 0:
         return (
@@ -406,6 +569,45 @@ def associate(
             np.arange(len(detections)),
             np.empty((0, 5), dtype=int),
         )
+    if approx_gating:
+        return associate_gated_approx(
+            detections,
+            trackers,
+            det_embs,
+            trk_embs,
+            iou_threshold,
+            velocities,
+            previous_obs,
+            vdc_weight,
+            w_assoc_emb,
+            aw_off,
+            aw_param,
+            emb_off,
+            grid_off,
+            context,
+        )
+
+    if cost_builder is not None:
+        return _associate_fused(
+            detections,
+            trackers,
+            det_embs,
+            trk_embs,
+            iou_threshold,
+            velocities,
+            previous_obs,
+            vdc_weight,
+            w_assoc_emb,
+            aw_off,
+            aw_param,
+            emb_off,
+            grid_off,
+            decompose,
+            solver,
+            warm_start,
+            cost_builder,
+            context,
+        )
 
     Y, X = speed_direction_batch(detections, previous_obs)
     inertia_Y, inertia_X = velocities[:, 0], velocities[:, 1]
@@ -419,7 +621,7 @@ def associate(
     valid_mask = np.ones(previous_obs.shape[0])
     valid_mask[np.where(previous_obs[:, 4] < 0)] = 0
 
-    iou_matrix = iou_batch(detections, trackers)
+    iou_matrix = iou_batch(detections, trackers) if context is None else context.iou
     scores = np.repeat(detections[:, -1][:, np.newaxis], trackers.shape[0], axis=1)
     # iou_matrix = iou_matrix * scores # a trick sometiems works, we don't encourage this
     valid_mask = np.repeat(valid_mask[:, np.newaxis], X.shape[1], axis=1)
@@ -441,18 +643,22 @@ def associate(
             matched_indices = np.stack(np.where(a), axis=1)
         else:
             if emb_cost is None:
+                # No appearance cost, nothing to weight
                 emb_cost = 0
-            else:
+            elif not aw_off:
                 # emb_cost[iou_matrix <= 0.3] = 0
-                pass
-            if not aw_off:
                 w_matrix = compute_aw_new_metric(emb_cost, w_assoc_emb, aw_param)
                 emb_cost *= w_matrix
             else:
                 emb_cost *= w_assoc_emb
 
             final_cost = -(iou_matrix + angle_diff_cost + emb_cost)
-            matched_indices = linear_assignment(final_cost)
+            if decompose:
+                # One small problem per cluster of overlapping detections and
+                # tracks instead of a global one
+                matched_indices = component_assignment(final_cost, a, solver)
+            else:
+                matched_indices = solver(final_cost, warm_start)
     else:
         matched_indices = np.empty(shape=(0, 2))
 
@@ -481,6 +687,134 @@ def associate(
     return matches, np.array(unmatched_detections), np.array(unmatched_trackers)
 
 
+def _associate_fused(
+    detections,
+    trackers,
+    det_embs,
+    trk_embs,
+    iou_threshold,
+    velocities,
+    previous_obs,
+    vdc_weight,
+    w_assoc_emb,
+    aw_off,
+    aw_param,
+    emb_off,
+    grid_off,
+    decompose,
+    solver,
+    warm_start,
+    cost_builder,
+    context,
+):
+    """associate() with the costs built by a costs.CostBuilder in reused buffers."""
+    iou_matrix = cost_builder.iou(detections, trackers) if context is None else context.iou
+    a = (iou_matrix > iou_threshold).astype(np.int32)
+    if len(detections) == 0:
+        matched_indices = np.empty((0, 2), dtype=int)
+    elif a.sum(1).max() == 1 and a.sum(0).max() == 1:
+        matched_indices = np.stack(np.where(a), axis=1)
+    else:
+        final_cost = cost_builder.cost(
+            iou_matrix,
+            detections,
+            det_embs,
+            trk_embs,
+            velocities,
+            previous_obs,
+            vdc_weight,
+            w_assoc_emb,
+            aw_off,
+            aw_param,
+            emb_off,
+            grid_off,
+        )
+        if decompose:
+            matched_indices = component_assignment(final_cost, a, solver)
+        else:
+            matched_indices = solver(final_cost, warm_start)
+
+    # Same order as associate(): the unmatched ones, then the low IoU matches
+    low = iou_matrix[matched_indices[:, 0], matched_indices[:, 1]] < iou_threshold
+    unmatched_detections = np.concatenate(
+        (np.setdiff1d(np.arange(len(detections)), matched_indices[:, 0]), matched_indices[low, 0])
+    )
+    unmatched_trackers = np.concatenate(
+        (np.setdiff1d(np.arange(len(trackers)), matched_indices[:, 1]), matched_indices[low, 1])
+    )
+    matches = matched_indices[~low].reshape(-1, 2)
+    return matches, unmatched_detections, unmatched_trackers
+
+
+def associate_gated_approx(
+    detections,
+    trackers,
+    det_embs,
+    trk_embs,
+    iou_threshold,
+    velocities,
+    previous_obs,
+    vdc_weight,
+    w_assoc_emb,
+    aw_off,
+    aw_param,
+    emb_off,
+    grid_off,
+    context=None,
+):
+    """
+    An approximation of associate, off by default: the same costs, but only
+    for the pairs that could pass the IoU filter. The overlapping pairs are
+    enumerated with a sort-and-sweep, the ones under iou_threshold are
+    dropped, and the assignment is solved on the remaining entries only. The
+    work follows the number of overlaps instead of N x M.
+
+    It is not exact: the dense solve also weighs the pairs under the
+    threshold, and may assign a detection to a track it barely overlaps (a
+    match then thrown away by the IoU filter) at the expense of a valid one,
+    which the gated solve keeps instead. So the matches differ on such
+    frames, usually crowded ones.
+    """
+    if context is None:
+        context = AssociationContext(detections, trackers, sparse=True)
+    d, t = context.candidate_pairs(iou_threshold)
+    iou = context.iou[d, t]
+
+    if np.bincount(d).max(initial=0) <= 1 and np.bincount(t).max(initial=0) <= 1:
+        # At most one candidate per detection and per track, nothing to solve
+        matched_indices = np.stack((d, t), axis=1)
+    else:
+        # Velocity direction consistency of the candidate pairs
+        Y, X = speed_direction_pairs(detections[d], previous_obs[t])
+        diff_angle_cos = velocities[t, 1] * X + velocities[t, 0] * Y
+        diff_angle_cos = np.clip(diff_angle_cos, a_min=-1, a_max=1)
+        diff_angle = np.arccos(diff_angle_cos)
+        diff_angle = (np.pi / 2.0 - np.abs(diff_angle)) / np.pi
+        valid_mask = (previous_obs[t, 4] >= 0).astype(float)
+        angle_diff_cost = (valid_mask * diff_angle) * vdc_weight * detections[d, -1]
+
+        emb_cost = 0
+        if not emb_off:
+            if not aw_off:
+                # The adaptive weights need the best two similarities of every
+                # row and column, so the full similarity matrix is computed
+                emb_cost = det_embs @ trk_embs.T if grid_off else split_cosine_dist(det_embs, trk_embs)
+                emb_cost = (emb_cost * compute_aw_new_metric(emb_cost, w_assoc_emb, aw_param))[d, t]
+            else:
+                if grid_off:
+                    emb_cost = np.einsum("kd,kd->k", det_embs[d], trk_embs[t])
+                else:
+                    emb_cost = split_cosine_dist_pairs(det_embs[d], trk_embs[t])
+                emb_cost *= w_assoc_emb
+
+        final_cost = -(iou + angle_diff_cost + emb_cost)
+        matched_indices = sparse_linear_assignment(final_cost, d, t, (len(detections), len(trackers)))
+
+    unmatched_detections = np.setdiff1d(np.arange(len(detections)), matched_indices[:, 0])
+    unmatched_trackers = np.setdiff1d(np.arange(len(trackers)), matched_indices[:, 1])
+    return matched_indices.astype(int), unmatched_detections, unmatched_trackers
+
+
 def associate_kitti(detections, trackers, det_cates, iou_threshold, velocities, previous_obs, vdc_weight):
     if len(trackers) == 0:
         return (
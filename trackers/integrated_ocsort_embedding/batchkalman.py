@@ -0,0 +1,280 @@
+"""
+    Batched linear Kalman filter for N tracks at once.
+
+    Same equations as KalmanFilterNew.predict/update, but the means are held
+    as a (N, dim_x) array and the covariances as (N, dim_x, dim_x), and any
+    subset of the rows is predicted/updated with stacked matmul and batched
+    LAPACK solves. The Python overhead is per frame instead of per track.
+
+    It also implements the observation-centric re-update (ORU) of
+    KalmanFilterNew, keeping only a compact snapshot (x, P and the last
+    measurement) per lost track and re-updating all the tracks found again
+    in a frame with one batched pass over the virtual trajectory.
+"""
+import numpy as np
+
+
+def new_kf_process_noise_batch(w, h, p=1 / 20, v=1 / 160):
+    """Vectorized new_kf_process_noise, returns (N, 8, 8)."""
+    diag = np.stack(
+        (
+            (p * w) ** 2,
+            (p * h) ** 2,
+            (p * w) ** 2,
+            (p * h) ** 2,
+            (v * w) ** 2,
+            (v * h) ** 2,
+            (v * w) ** 2,
+            (v * h) ** 2,
+        ),
+        axis=-1,
+    )
+    return _diag_batch(diag)
+
+
+def new_kf_measurement_noise_batch(w, h, m=1 / 20):
+    """Vectorized new_kf_measurement_noise, returns (N, 4, 4)."""
+    w_var = (m * w) ** 2
+    h_var = (m * h) ** 2
+    return _diag_batch(np.stack((w_var, h_var, w_var, h_var), axis=-1))
+
+
+def _diag_batch(diag):
+    n, d = diag.shape
+    out = np.zeros((n, d, d))
+    idx = np.arange(d)
+    out[:, idx, idx] = diag
+    return out
+
+
+class BatchKalmanFilter(object):
+    """
+    Bank of Kalman filters sharing F, H and the default Q, R.
+
+    Rows are added with add() and removed with keep(); x, P and the ORU
+    columns are live views of the first n rows of the underlying buffers.
+    new_kf selects the [x,y,w,h] (else [x,y,s,r]) measurement space for the
+    virtual trajectory of the ORU.
+    """
+
+    COLUMNS = ("x", "P", "saved_x", "saved_P", "saved_z", "last_z", "n_missed", "observed", "has_saved")
+
+    def __init__(self, F, H, Q, R, new_kf=False, capacity=64):
+        self.F = np.asarray(F, dtype=float)
+        self.H = np.asarray(H, dtype=float)
+        self.Q = np.asarray(Q, dtype=float)
+        self.R = np.asarray(R, dtype=float)
+        self.dim_x = self.F.shape[0]
+        self.dim_z = self.H.shape[0]
+        self.new_kf = new_kf
+        self._I = np.eye(self.dim_x)
+
+        self.n = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        d, dz = self.dim_x, self.dim_z
+        shapes = {
+            "x": ((d,), float),
+            "P": ((d, d), float),
+            # State saved when the track lost its observation, for the ORU
+            "saved_x": ((d,), float),
+            "saved_P": ((d, d), float),
+            "saved_z": ((dz,), float),
+            "last_z": ((dz,), float),
+            # Number of updates without observation since the state was saved
+            "n_missed": ((), np.int64),
+            "observed": ((), bool),
+            "has_saved": ((), bool),
+        }
+        for name in self.COLUMNS:
+            shape, dtype = shapes[name]
+            col = np.zeros((capacity,) + shape, dtype=dtype)
+            old = self.__dict__.get("_" + name)
+            if old is not None:
+                col[: self.n] = old[: self.n]
+            setattr(self, "_" + name, col)
+
+    @classmethod
+    def box_filter(cls, new_kf, capacity=64):
+        """
+        The two motion models of KalmanBoxTracker: the 8-state [x,y,w,h]
+        model when new_kf, the 7-state [x,y,s,r] one of SORT otherwise.
+        Q and R are the defaults of KalmanBoxTracker, the new_kf model
+        passes per-track noise to predict/update instead.
+        """
+        if new_kf:
+            # x y w h x' y' w' h'
+            F = np.eye(8)
+            F[:4, 4:] = np.eye(4)
+            H = np.eye(4, 8)
+            Q = np.eye(8)
+            R = np.eye(4)
+        else:
+            # x  y  s  r  x' y' s'
+            F = np.eye(7)
+            F[0, 4] = F[1, 5] = F[2, 6] = 1
+            H = np.eye(4, 7)
+            R = np.eye(4)
+            R[2:, 2:] *= 10.0
+            Q = np.eye(7)
+            Q[-1, -1] *= 0.01
+            Q[4:, 4:] *= 0.01
+        return cls(F, H, Q, R, new_kf=new_kf, capacity=capacity)
+
+    def __len__(self):
+        return self.n
+
+    def __getattr__(self, name):
+        if name in BatchKalmanFilter.COLUMNS:
+            return self.__dict__["_" + name][: self.__dict__["n"]]
+        raise AttributeError(name)
+
+    def add(self, x, P):
+        """Appends len(x) filters with the given means and covariances."""
+        k = x.shape[0]
+        if self.n + k > self._x.shape[0]:
+            self._allocate(max(2 * self._x.shape[0], self.n + k))
+        rows = slice(self.n, self.n + k)
+        self._x[rows] = x
+        self._P[rows] = P
+        self._n_missed[rows] = 0
+        self._observed[rows] = False
+        self._has_saved[rows] = False
+        self.n += k
+
+    def keep(self, mask):
+        """Drops the rows where mask is False, preserving order."""
+        k = int(mask.sum())
+        for name in self.COLUMNS:
+            col = getattr(self, "_" + name)
+            col[:k] = col[: self.n][mask]
+        self.n = k
+
+    def predict(self, idx=None, Q=None):
+        """
+        Predict step for the rows idx (all rows when None).
+
+        Q is None (use self.Q), one (dim_x, dim_x) matrix for all rows or a
+        (len(idx), dim_x, dim_x) stack of per-row matrices.
+        """
+        if Q is None:
+            Q = self.Q
+        F = self.F
+        if idx is None:
+            x, P = self.x, self.P
+            # x = Fx
+            x[:] = x @ F.T
+            # P = FPF' + Q
+            P[:] = F @ P @ F.T + Q
+        else:
+            self._x[idx] = self._x[idx] @ F.T
+            self._P[idx] = F @ self._P[idx] @ F.T + Q
+
+    def update(self, idx, z, R=None):
+        """
+        Update step of the rows idx with the measurements z, (len(idx), dim_z).
+        If z is None the rows got no observation, as KalmanFilterNew.update(None).
+
+        R is None (use self.R), one (dim_z, dim_z) matrix or a per-row stack.
+        """
+        idx = np.asarray(idx, dtype=int)
+        if len(idx) == 0:
+            return
+        if z is None:
+            # Got no observation so freeze the current parameters for future
+            # potential online smoothing.
+            freeze = idx[self.observed[idx]]
+            self.saved_x[freeze] = self.x[freeze]
+            self.saved_P[freeze] = self.P[freeze]
+            self.saved_z[freeze] = self.last_z[freeze]
+            self.has_saved[freeze] = True
+            self.n_missed[freeze] = 0
+            self.n_missed[idx] += 1
+            self.observed[idx] = False
+            return
+
+        if R is None:
+            R = self.R
+        oru = ~self.observed[idx] & self.has_saved[idx]
+        if oru.any():
+            # Get observation, use online smoothing to re-update parameters
+            self.unfreeze(idx[oru], z[oru])
+        self.observed[idx] = True
+        x, P = self.update_state(self._x[idx], self._P[idx], z, R)
+        self._x[idx] = x
+        self._P[idx] = P
+        # The ORU rows keep the last virtual measurement, see unfreeze
+        self.last_z[idx[~oru]] = z[~oru]
+
+    def unfreeze(self, idx, z):
+        """
+        Observation-centric re-update of the rows idx, found again with the
+        measurements z: restart from the saved state and re-update along a
+        linear virtual trajectory from the last measurement to z, with the
+        default Q and R.
+
+        All the rows are re-updated together, one batched predict/update per
+        step of the longest gap, so the cost does not depend on the length
+        of the track history.
+        """
+        self.has_saved[idx] = False
+        x = self.saved_x[idx]
+        P = self.saved_P[idx]
+        box1 = self._z_to_xywh(self.saved_z[idx])
+        box2 = self._z_to_xywh(z)
+        time_gap = self.n_missed[idx] + 1
+        delta = (box2 - box1) / time_gap[:, np.newaxis]
+        for i in range(time_gap.max()):
+            """
+            The default virtual trajectory generation is by linear
+            motion (constant speed hypothesis), you could modify this
+            part to implement your own.
+            """
+            rows = i < time_gap
+            box = box1[rows] + (i + 1) * delta[rows]
+            if not self.new_kf:
+                w, h = box[:, 2], box[:, 3]
+                box = np.stack((box[:, 0], box[:, 1], w * h, w / h), axis=1)
+            x[rows], P[rows] = self.update_state(x[rows], P[rows], box, self.R)
+            rows = i < time_gap - 1
+            x[rows] = x[rows] @ self.F.T
+            P[rows] = self.F @ P[rows] @ self.F.T + self.Q
+        self.x[idx] = x
+        self.P[idx] = P
+        # As in KalmanFilterNew, the last measurement of the track is now the
+        # end of the virtual trajectory, not z
+        box = box1 + time_gap[:, np.newaxis] * delta
+        if not self.new_kf:
+            w, h = box[:, 2], box[:, 3]
+            box = np.stack((box[:, 0], box[:, 1], w * h, w / h), axis=1)
+        self.last_z[idx] = box
+
+    def _z_to_xywh(self, z):
+        if self.new_kf:
+            return z.copy()
+        s, r = z[:, 2], z[:, 3]
+        return np.stack((z[:, 0], z[:, 1], np.sqrt(s * r), np.sqrt(s / r)), axis=1)
+
+    def update_state(self, x, P, z, R):
+        """
+        Batched update of the given (k, dim_x) means and (k, dim_x, dim_x)
+        covariances, returns the posteriors. Does not touch the stored rows.
+        """
+        H = self.H
+        x = x[..., np.newaxis]
+        z = z.reshape(x.shape[0], self.dim_z, 1)
+        # y = z - Hx
+        y = z - H @ x
+        # common subexpression for speed
+        PHT = P @ H.T
+        # S = HPH' + R
+        S = H @ PHT + R
+        # K = PH'inv(S), batched LU solve of S against the identity
+        K = PHT @ np.linalg.inv(S)
+        # x = x + Ky
+        x = x + K @ y
+        # P = (I-KH)P(I-KH)' + KRK'
+        I_KH = self._I - K @ H
+        P = I_KH @ P @ np.swapaxes(I_KH, -1, -2) + K @ R @ np.swapaxes(K, -1, -2)
+        return x[..., 0], P
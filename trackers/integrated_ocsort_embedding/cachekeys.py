@@ -0,0 +1,48 @@
+"""
+    Content-addressed keys of the cached artifacts.
+
+    A cache folder is named after a digest of everything that determines
+    its content (model weights, preprocessing config), so that changing any
+    of them starts a new cache instead of reusing stale entries. Within a
+    folder the entries are keyed by what the computation actually sees, e.g.
+    the pixel box of a crop, so that they stay valid across experiments that
+    select different detections.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# (path, size, mtime) -> digest, hashing large weights once per process
+_file_digests = {}
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """sha1 of the file content, of the path itself if it does not exist."""
+    if not os.path.exists(path):
+        return hashlib.sha1(path.encode()).hexdigest()
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if key not in _file_digests:
+        h = hashlib.sha1()
+        with open(path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(chunk_size), b""):
+                h.update(chunk)
+        _file_digests[key] = h.hexdigest()
+    return _file_digests[key]
+
+
+def config_digest(*parts, length=12):
+    """Short digest of JSON-serializable parts."""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:length]
+
+
+def box_keys(boxes):
+    """One "x1,y1,x2,y2" key per row of integer pixel boxes."""
+    return [",".join(map(str, b)) for b in np.asarray(boxes, dtype=np.int64).tolist()]
+
+
+def boxes_digest(boxes, length=12):
+    """Short digest of a set of integer pixel boxes."""
+    return hashlib.sha1(np.ascontiguousarray(boxes, dtype=np.int64).tobytes()).hexdigest()[:length]
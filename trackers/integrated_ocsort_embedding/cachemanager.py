@@ -0,0 +1,143 @@
+"""
+    One in-memory cache for the detections, embeddings and CMC affines.
+
+    Every cache of the pipeline is a namespace of the shared CACHE. All the
+    entries are numpy arrays, kept in a single least recently used order
+    within a total RAM budget. A namespace can be backed by an on-disk store
+    (a FrameArrayCache): its new entries are written there at the latest
+    when they are evicted or on flush, and a lookup that misses the memory
+    reads the store. The entries of a namespace without a store are simply
+    dropped, they are recomputed (or reloaded by their owner) on the next
+    miss. All the stores are flushed every flush_interval seconds and at
+    exit, so an interrupted run resumes with what it had computed.
+"""
+import atexit
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheNamespace(object):
+    def __init__(self, manager, name):
+        self.manager = manager
+        self.name = name
+        self.store = None
+        # Entries not in the store yet, key -> value
+        self.dirty = OrderedDict()
+        self.hits = 0
+        self.loads = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+
+    def attach(self, store):
+        """Switches to another on-disk store, e.g. at a new sequence."""
+        with self.manager.lock:
+            self.flush()
+            self.store = store
+
+    def __contains__(self, key):
+        return (self.name, key) in self.manager.entries or (self.store is not None and key in self.store)
+
+    def get(self, key):
+        """The value of key, None if it is neither in memory nor in the store."""
+        with self.manager.lock:
+            value = self.manager._lookup(self, key)
+            if value is not None:
+                self.hits += 1
+                return value
+            if self.store is not None and key in self.store:
+                self.loads += 1
+                value = self.store.get(key)
+                self.manager._insert(self, key, value)
+                return value
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.manager.lock:
+            if self.store is not None:
+                self.dirty[key] = value
+            self.manager._insert(self, key, value)
+
+    def flush(self):
+        """Writes the new entries to the store in one append."""
+        with self.manager.lock:
+            if self.dirty and self.store is not None:
+                self.store.extend(list(self.dirty.keys()), list(self.dirty.values()))
+            self.dirty.clear()
+
+    def summary(self):
+        return (
+            f"{self.name}: {self.hits} hits, {self.loads} disk loads, {self.misses} misses, "
+            f"{self.bytes / 2**20:.1f} MB, {self.evictions} evictions"
+        )
+
+
+class CacheManager(object):
+    def __init__(self, budget=1 << 30, flush_interval=30.0):
+        """
+        budget: total bytes of the in-memory entries of all the namespaces.
+        flush_interval: seconds between two writes of the new entries.
+        """
+        self.budget = budget
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.namespaces = {}
+        # (namespace, key) -> value, least recently used first
+        self.entries = OrderedDict()
+        self.bytes = 0
+        # The CMC worker thread uses the cache too
+        self.lock = threading.RLock()
+
+    def namespace(self, name):
+        """The namespace of that name, created on first use."""
+        with self.lock:
+            if name not in self.namespaces:
+                self.namespaces[name] = CacheNamespace(self, name)
+            return self.namespaces[name]
+
+    def _lookup(self, namespace, key):
+        value = self.entries.get((namespace.name, key))
+        if value is not None:
+            self.entries.move_to_end((namespace.name, key))
+        return value
+
+    def _insert(self, namespace, key, value):
+        old = self.entries.pop((namespace.name, key), None)
+        if old is not None:
+            self.bytes -= old.nbytes
+            namespace.bytes -= old.nbytes
+        self.entries[(namespace.name, key)] = value
+        self.bytes += value.nbytes
+        namespace.bytes += value.nbytes
+        self._evict()
+        if time.monotonic() - self.last_flush > self.flush_interval:
+            self.flush()
+
+    def _evict(self):
+        # The most recent entry stays even when it alone exceeds the budget
+        while self.bytes > self.budget and len(self.entries) > 1:
+            (name, key), value = self.entries.popitem(last=False)
+            namespace = self.namespaces[name]
+            self.bytes -= value.nbytes
+            namespace.bytes -= value.nbytes
+            namespace.evictions += 1
+            if key in namespace.dirty:
+                namespace.flush()
+
+    def flush(self):
+        """Writes the new entries of all the namespaces to their stores."""
+        with self.lock:
+            for namespace in self.namespaces.values():
+                namespace.flush()
+            self.last_flush = time.monotonic()
+
+    def summary(self):
+        return "\n".join(namespace.summary() for namespace in self.namespaces.values())
+
+
+# Shared by all the caches of the process, main.py sets the budget
+CACHE = CacheManager()
+# Also on Ctrl-C and uncaught errors
+atexit.register(CACHE.flush)
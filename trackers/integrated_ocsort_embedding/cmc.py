@@ -1,18 +1,45 @@
 import pdb
 import pickle
 import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import numpy as np
 
+from .cachekeys import boxes_digest
+from .cachemanager import CACHE
+from .framecache import FrameArrayCache, convert_pickle
+
+# Whether each method looks at the frame. The grayscale frame and the mask
+# of the detections are only built for those.
+NEEDS_FRAME = {"file": False, "sparse": True, "sift": True, "fast": True}
+# Resolution of the frame and mask given to each method, see __init__ for fast
+FRAME_SCALE = {"sparse": 1.0, "sift": 1.0}
+
+# BoT-SORT GMC text files, compiled to a single binary store on first use,
+# recompile it with python -m trackers.integrated_ocsort_embedding.cmc
+CMC_FILES = "./cache/cmc_files"
+CMC_STORE = "./cache/cmc_files_compiled"
+
 
 class CMCComputer:
-    def __init__(self, minimum_features=10, method="file"):
-        assert method in ["file", "sparse", "sift"]
+    def __init__(self, minimum_features=10, method="file", scale=0.5, max_points=400, min_points=150):
+        """
+        method: file (precomputed BoT-SORT GMC), sparse, sift or fast.
+        scale, max_points, min_points: of the fast method, which tracks at most
+            max_points corners on the frame downscaled by scale, and detects
+            new ones when fewer than min_points remain.
+        """
+        assert method in ["file", "sparse", "sift", "fast"]
+        self.method = method
+        self.needs_frame = NEEDS_FRAME[method]
+        self.frame_scale = FRAME_SCALE.get(method, scale)
 
         os.makedirs("./cache", exist_ok=True)
         self.cache_path = "./cache/affine_ocsort.pkl"
-        self.cache = {}
+        self.cache = CACHE.namespace("cmc")
         # if os.path.exists(self.cache_path):
         #    with open(self.cache_path, "rb") as fp:
         #        self.cache = pickle.load(fp)
@@ -27,86 +54,106 @@ class CMCComputer:
             useHarrisDetector=False,
             k=0.04,
         )
+        # Affines of the GMC files missing from the compiled store
         self.file_computed = {}
+        # Built once for all the frames
+        self.sift = None
+        self.matcher = None
+        self.max_points = max_points
+        self.min_points = min_points
+        self.fast_flow_param = dict(qualityLevel=0.01, minDistance=8, blockSize=3)
+        self.prev_points = None
 
         self.comp_function = None
         if method == "sparse":
             self.comp_function = self._affine_sparse_flow
         elif method == "sift":
             self.comp_function = self._affine_sift
+        elif method == "fast":
+            self.comp_function = self._affine_fast
         # Same BoT-SORT CMC arrays
         elif method == "file":
             self.comp_function = self._affine_file
-            self.file_affines = {}
-            # Maps from tag name to file name
-            self.file_names = {}
-
-            # DanceTrack
-            for f_name in os.listdir("./cache/cmc_files/DanceTrack/"):
-                tag = f_name.replace("GMC-", "").replace(".txt", "").replace("-", "")
-                f_name = os.path.join("./cache/cmc_files/DanceTrack/", f_name)
-                self.file_names[tag] = f_name
-
-            # All the ablation file names
-            for f_name in os.listdir("./cache/cmc_files/MOT17_ablation/"):
-                # The tag that'll be passed into compute_affine based on image name
-                tag = f_name.replace("GMC-", "").replace(".txt", "") + "-FRCNN"
-                f_name = os.path.join("./cache/cmc_files/MOT17_ablation/", f_name)
-                self.file_names[tag] = f_name
-            for f_name in os.listdir("./cache/cmc_files/MOT20_ablation/"):
-                tag = f_name.replace("GMC-", "").replace(".txt", "")
-                f_name = os.path.join("./cache/cmc_files/MOT20_ablation/", f_name)
-                self.file_names[tag] = f_name
-
-            # All the test file names
-            for f_name in os.listdir("./cache/cmc_files/MOTChallenge/"):
-                tag = f_name.replace("GMC-", "").replace(".txt", "")
-                if "MOT17" in tag:
-                    tag = tag + "-FRCNN"
-                # If it's an ablation one (not test) don't overwrite it
-                if tag in self.file_names:
-                    continue
-                f_name = os.path.join("./cache/cmc_files/MOTChallenge/", f_name)
-                self.file_names[tag] = f_name
+            # (frames, 2, 3) affines per sequence, read from the compiled store
+            self.file_affines = CACHE.namespace("cmc_files")
+            if not os.path.exists(CMC_STORE):
+                compile_cmc_files(replace=False)
+            self.file_affines.attach(FrameArrayCache(CMC_STORE, np.float64))
 
     def compute_affine(self, img, bbox, tag):
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        if tag in self.cache:
-            A = self.cache[tag]
+        bbox = np.round(bbox).astype(np.int32)
+        bbox[bbox < 0] = 0
+        key = self._cache_key(bbox, tag)
+        A = self.cache.get(key)
+        if A is not None:
             return A
-        mask = np.ones_like(img, dtype=np.uint8)
-        if bbox.shape[0] > 0:
-            bbox = np.round(bbox).astype(np.int32)
-            bbox[bbox < 0] = 0
-            for bb in bbox:
-                mask[bb[1] : bb[3], bb[0] : bb[2]] = 0
 
-        A = self.comp_function(img, mask, tag)
-        self.cache[tag] = A
+        frame = mask = None
+        if self.needs_frame:
+            frame, mask = self._frame_and_mask(img, bbox)
+        A = self.comp_function(frame, mask, tag)
+        self.cache.put(key, A)
 
         return A
 
+    def _frame_and_mask(self, img, bbox):
+        """
+        The grayscale frame at frame_scale and the mask of its background,
+        0 in the detections.
+        """
+        if self.frame_scale != 1.0:
+            img = cv2.resize(img, None, fx=self.frame_scale, fy=self.frame_scale, interpolation=cv2.INTER_AREA)
+            # The boxes grow to whole pixels of the smaller frame
+            bbox = np.concatenate(
+                (np.floor(bbox[:, :2] * self.frame_scale), np.ceil(bbox[:, 2:4] * self.frame_scale)), axis=1
+            ).astype(np.int32)
+        frame = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # Slices of the few boxes, faster than any whole-frame rasterization
+        mask = np.ones_like(frame, dtype=np.uint8)
+        for bb in bbox:
+            mask[bb[1] : bb[3], bb[0] : bb[2]] = 0
+        return frame, mask
+
+    def _cache_key(self, bbox, tag):
+        """The file affines only depend on the frame, the estimated ones also on the masked boxes."""
+        if self.method == "file":
+            return self.method, tag
+        return self.method, tag, boxes_digest(bbox[:, :4])
+
     def _affine_file(self, frame, mask, tag):
         name, num = tag.split(":")
-        if name not in self.file_affines:
-            self._load_file(name)
-        if name not in self.file_affines:
-            raise RuntimeError("Error loading file affines for CMC.")
+        affines = self.file_affines.get(name)
+        if affines is None:
+            affines = self._load_uncompiled(name)
+
+        return affines[int(num) - 1]
 
-        return self.file_affines[name][int(num) - 1]
+    def _load_uncompiled(self, name):
+        """
+        The affines of a GMC file added since the store was compiled, read
+        from the text file once. The store is only rebuilt on request.
+        """
+        if name not in self.file_computed:
+            path = gmc_file_names().get(name)
+            if path is None:
+                raise RuntimeError("Error loading file affines for CMC.")
+            print(f"Warning: {name} is not in {CMC_STORE}, python -m trackers.integrated_ocsort_embedding.cmc adds it")
+            self.file_computed[name] = load_gmc_file(path)
+        return self.file_computed[name]
 
     def _affine_sift(self, frame, mask, tag):
         A = np.eye(2, 3)
-        detector = cv2.SIFT_create()
-        kp, desc = detector.detectAndCompute(frame, mask)
+        if self.sift is None:
+            self.sift = cv2.SIFT_create()
+            self.matcher = cv2.BFMatcher(cv2.NORM_L2)
+        kp, desc = self.sift.detectAndCompute(frame, mask)
         if self.prev_desc is None:
             self.prev_desc = [kp, desc]
             return A
         if desc.shape[0] < self.minimum_features or self.prev_desc[1].shape[0] < self.minimum_features:
             return A
 
-        bf = cv2.BFMatcher(cv2.NORM_L2)
-        matches = bf.knnMatch(self.prev_desc[1], desc, k=2)
+        matches = self.matcher.knnMatch(self.prev_desc[1], desc, k=2)
         good = []
         for m, n in matches:
             if m.distance < 0.7 * n.distance:
@@ -156,22 +203,163 @@ class CMCComputer:
         self.prev_desc = keypoints
         return A
 
-    def _load_file(self, name):
-        affines = []
-        with open(self.file_names[name], "r") as fp:
-            for line in fp:
-                tokens = [float(f) for f in line.split("\t")[1:7]]
-                A = np.eye(2, 3)
-                A[0, 0] = tokens[0]
-                A[0, 1] = tokens[1]
-                A[0, 2] = tokens[2]
-                A[1, 0] = tokens[3]
-                A[1, 1] = tokens[4]
-                A[1, 2] = tokens[5]
-                affines.append(A)
-        self.file_affines[name] = affines
+    def _affine_fast(self, frame, mask, tag):
+        """
+        Sparse flow of a bounded set of background corners, tracked from frame
+        to frame on the downscaled frame. The affine is scaled back to full
+        resolution.
+        """
+        A = np.eye(2, 3)
+
+        points = None
+        if self.prev_img is not None and len(self.prev_points) > 0:
+            curr_points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_img, frame, self.prev_points, None)
+            found = status.ravel() == 1
+            prev_points = self.prev_points[found]
+            points = curr_points[found]
+            if len(points) > self.minimum_features:
+                A, inliers = cv2.estimateAffinePartial2D(prev_points, points, method=cv2.RANSAC)
+                if A is None:
+                    A = np.eye(2, 3)
+                else:
+                    A[:, 2] /= self.frame_scale
+                    # The outliers are on moving objects, they are not tracked further
+                    points = points[inliers.ravel() == 1]
+            else:
+                print("Warning: not enough matching points")
+            points = points[self._on_background(points, mask)]
+
+        if points is None or len(points) < self.min_points:
+            points = self._replenish(frame, mask, points)
+        self.prev_img = frame
+        self.prev_points = points
+        return A
+
+    @staticmethod
+    def _on_background(points, mask):
+        """Mask of the (n, 1, 2) points inside the frame and outside the detections."""
+        xy = np.round(points.reshape(-1, 2)).astype(int)
+        h, w = mask.shape
+        keep = (xy[:, 0] >= 0) & (xy[:, 0] < w) & (xy[:, 1] >= 0) & (xy[:, 1] < h)
+        keep[keep] = mask[xy[keep, 1], xy[keep, 0]] > 0
+        return keep
+
+    def _replenish(self, frame, mask, points):
+        """Adds new corners away from the tracked points, up to max_points."""
+        if points is None:
+            points = np.empty((0, 1, 2), dtype=np.float32)
+        else:
+            mask = mask.copy()
+            for x, y in points.reshape(-1, 2):
+                cv2.circle(mask, (int(x), int(y)), self.fast_flow_param["minDistance"], 0, -1)
+        new_points = cv2.goodFeaturesToTrack(
+            frame, mask=mask, maxCorners=self.max_points - len(points), **self.fast_flow_param
+        )
+        if new_points is None:
+            return points
+        return np.concatenate((points, new_points.astype(np.float32)))
 
     def dump_cache(self):
         return
         with open(self.cache_path, "wb") as fp:
             pickle.dump(self.cache, fp)
+
+
+class CMCWorker(object):
+    """
+    Runs the compute_affine of a CMCComputer in a background thread, started
+    as soon as the frame is available and joined just before the tracks are
+    warped. OpenCV releases the GIL, so a live method overlaps with the
+    detector and the ReID. A single thread keeps the frames in order, as the
+    live methods track from the previous frame.
+    """
+
+    def __init__(self, cmc):
+        self.cmc = cmc
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # tag -> future of the started frames
+        self.pending = {}
+
+    def submit(self, img, bbox, tag):
+        self.pending[tag] = self.executor.submit(self.cmc.compute_affine, img, bbox, tag)
+
+    def result(self, img, bbox, tag):
+        """The affine of the frame, computed now if it was not started."""
+        future = self.pending.pop(tag, None)
+        if future is None:
+            future = self.executor.submit(self.cmc.compute_affine, img, bbox, tag)
+        # Frames started but never tracked (no detections) are not waited for
+        self.pending.clear()
+        return future.result()
+
+    def close(self):
+        """Waits for the started frames and stops the thread."""
+        self.executor.shutdown(wait=True)
+        self.pending.clear()
+
+
+def gmc_file_names(root=CMC_FILES):
+    """Maps the sequence names to their BoT-SORT GMC text files."""
+    file_names = {}
+
+    # DanceTrack
+    for f_name in os.listdir(os.path.join(root, "DanceTrack")):
+        tag = f_name.replace("GMC-", "").replace(".txt", "").replace("-", "")
+        file_names[tag] = os.path.join(root, "DanceTrack", f_name)
+
+    # All the ablation file names
+    for f_name in os.listdir(os.path.join(root, "MOT17_ablation")):
+        # The tag that'll be passed into compute_affine based on image name
+        tag = f_name.replace("GMC-", "").replace(".txt", "") + "-FRCNN"
+        file_names[tag] = os.path.join(root, "MOT17_ablation", f_name)
+    for f_name in os.listdir(os.path.join(root, "MOT20_ablation")):
+        tag = f_name.replace("GMC-", "").replace(".txt", "")
+        file_names[tag] = os.path.join(root, "MOT20_ablation", f_name)
+
+    # All the test file names
+    for f_name in os.listdir(os.path.join(root, "MOTChallenge")):
+        tag = f_name.replace("GMC-", "").replace(".txt", "")
+        if "MOT17" in tag:
+            tag = tag + "-FRCNN"
+        # If it's an ablation one (not test) don't overwrite it
+        if tag in file_names:
+            continue
+        file_names[tag] = os.path.join(root, "MOTChallenge", f_name)
+    return file_names
+
+
+def load_gmc_file(path):
+    """(frames, 2, 3) affines of a GMC file of "frame<TAB>a00<TAB>a01<TAB>a02<TAB>a10<TAB>a11<TAB>a12" lines."""
+    return np.loadtxt(path, delimiter="\t", usecols=range(1, 7), ndmin=2).reshape(-1, 2, 3)
+
+
+def compile_cmc_files(root=CMC_FILES, folder=CMC_STORE, replace=True):
+    """
+    Compiles all the GMC text files into one FrameArrayCache keyed by
+    sequence name. The store is built in a folder of its own and renamed
+    into place, so parallel runs never see a partial one.
+    replace: replace an existing store, else keep the one that another run
+        may have compiled in the meantime.
+    """
+    print(f"Compiling the CMC files of {root} to {folder}")
+    affines = {tag: load_gmc_file(path) for tag, path in gmc_file_names(root).items()}
+    parent, base = os.path.split(os.path.abspath(folder))
+    tmp = tempfile.mkdtemp(prefix=base + ".", dir=parent)
+    try:
+        convert_pickle(affines, os.path.join(tmp, "store"), np.float64)
+        if replace and os.path.exists(folder):
+            # The maps of a run still reading it stay valid
+            os.rename(folder, os.path.join(tmp, "old"))
+        try:
+            os.rename(os.path.join(tmp, "store"), folder)
+        except OSError:
+            # Another run compiled it meanwhile
+            pass
+    finally:
+        shutil.rmtree(tmp)
+    return FrameArrayCache(folder, np.float64)
+
+
+if __name__ == "__main__":
+    # python -m trackers.integrated_ocsort_embedding.cmc, after adding GMC files
+    compile_cmc_files()
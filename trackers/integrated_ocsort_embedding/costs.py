@@ -0,0 +1,146 @@
+"""
+    Fused construction of the first-round association cost.
+
+    associate() builds the IoU, the velocity direction consistency, the
+    score weighting and the embedding similarity as a dozen N x M
+    temporaries (with np.repeat for the per-row and per-column terms).
+    CostBuilder computes the same terms with broadcasting and in-place
+    ufuncs into a few buffers that are kept from one frame to the next and
+    only grow, so a frame allocates almost nothing of size N x M.
+
+    The arithmetic follows associate() operation by operation, with
+    dtype=np.float64 the costs are bit-identical.
+"""
+import numpy as np
+
+from .association import split_cosine_dist
+
+
+class CostBuilder(object):
+    # Number of N x M buffers: IoU, cost, and three scratch ones
+    N_BUFFERS = 5
+
+    def __init__(self, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self._flat = [np.empty(0, dtype=self.dtype) for _ in range(self.N_BUFFERS)]
+
+    def _buffers(self, n, m):
+        size = n * m
+        if size > self._flat[0].size:
+            # Grow with headroom so that small changes of N, M do not reallocate
+            capacity = max(size, 2 * self._flat[0].size)
+            self._flat = [np.empty(capacity, dtype=self.dtype) for _ in range(self.N_BUFFERS)]
+        return [buf[:size].reshape(n, m) for buf in self._flat]
+
+    def iou(self, detections, trackers):
+        """
+        IoU of the detections (rows) and trackers (columns), the same
+        computation as iou_batch. The result lives in a reused buffer and is
+        valid until the next call.
+        """
+        iou, _, s1, s2, _ = self._buffers(len(detections), len(trackers))
+        d = np.asarray(detections[:, :4], dtype=self.dtype)
+        t = np.asarray(trackers[:, :4], dtype=self.dtype)
+        d = d[:, np.newaxis]
+        t = t[np.newaxis]
+        # w = max(0, min(x2) - max(x1)), h likewise
+        np.minimum(d[..., 2], t[..., 2], out=s1)
+        s1 -= np.maximum(d[..., 0], t[..., 0], out=s2)
+        np.maximum(0.0, s1, out=s1)
+        np.minimum(d[..., 3], t[..., 3], out=s2)
+        s2 -= np.maximum(d[..., 1], t[..., 1], out=iou)
+        np.maximum(0.0, s2, out=s2)
+        wh = np.multiply(s1, s2, out=s1)
+        area_d = (d[..., 2] - d[..., 0]) * (d[..., 3] - d[..., 1])
+        area_t = (t[..., 2] - t[..., 0]) * (t[..., 3] - t[..., 1])
+        union = np.add(area_d, area_t, out=s2)
+        union -= wh
+        return np.divide(wh, union, out=iou)
+
+    def cost(
+        self,
+        iou_matrix,
+        detections,
+        det_embs,
+        trk_embs,
+        velocities,
+        previous_obs,
+        vdc_weight,
+        w_assoc_emb,
+        aw_off,
+        aw_param,
+        emb_off,
+        grid_off,
+    ):
+        """
+        -(iou_matrix + velocity direction cost + weighted embedding similarity),
+        iou_matrix is typically the result of iou().
+        """
+        n, m = iou_matrix.shape
+        _, cost, s1, s2, s3 = self._buffers(n, m)
+
+        # Velocity direction consistency, [detection, track]
+        det_cx = (detections[:, 0] + detections[:, 2]) / 2.0
+        det_cy = (detections[:, 1] + detections[:, 3]) / 2.0
+        trk_cx = (previous_obs[:, 0] + previous_obs[:, 2]) / 2.0
+        trk_cy = (previous_obs[:, 1] + previous_obs[:, 3]) / 2.0
+        dx = np.subtract(det_cx[:, np.newaxis], trk_cx[np.newaxis], out=s1)
+        dy = np.subtract(det_cy[:, np.newaxis], trk_cy[np.newaxis], out=s2)
+        norm = np.multiply(dx, dx, out=s3)
+        norm += np.multiply(dy, dy, out=cost)
+        np.sqrt(norm, out=norm)
+        norm += 1e-6
+        dx /= norm
+        dy /= norm
+        # diff_angle_cos = inertia_X * X + inertia_Y * Y
+        dx *= velocities[np.newaxis, :, 1]
+        dy *= velocities[np.newaxis, :, 0]
+        angle = np.add(dx, dy, out=s1)
+        np.clip(angle, -1, 1, out=angle)
+        np.arccos(angle, out=angle)
+        np.abs(angle, out=angle)
+        np.subtract(np.pi / 2.0, angle, out=angle)
+        angle /= np.pi
+        angle *= (previous_obs[:, 4] >= 0)[np.newaxis]
+        angle *= vdc_weight
+        angle *= detections[:, -1][:, np.newaxis]
+
+        np.add(iou_matrix, angle, out=cost)
+
+        if not emb_off:
+            emb = s2
+            if grid_off:
+                np.matmul(np.asarray(det_embs, dtype=self.dtype), np.asarray(trk_embs, dtype=self.dtype).T, out=emb)
+            else:
+                emb[:] = split_cosine_dist(det_embs, trk_embs)
+            if not aw_off:
+                weight = self._aw_weight(emb, w_assoc_emb, aw_param, s3)
+                emb *= weight
+            else:
+                emb *= w_assoc_emb
+            cost += emb
+
+        return np.negative(cost, out=cost)
+
+    def _aw_weight(self, emb, w_assoc_emb, max_diff, out):
+        """compute_aw_new_metric(emb, ...) written into out."""
+        n, m = emb.shape
+        out[:] = 0
+        if m >= 2:
+            out += (np.minimum(self._top2_gap(emb, 1), max_diff) / 2)[:, np.newaxis]
+        if n >= 2:
+            out += (np.minimum(self._top2_gap(emb, 0), max_diff) / 2)[np.newaxis]
+        out += w_assoc_emb
+        return out
+
+    @staticmethod
+    def _top2_gap(x, axis):
+        """top2_gap without copying x, the knocked out maxima are restored."""
+        best = np.argmax(x, axis=axis)
+        idx = np.arange(len(best))
+        pos = (idx, best) if axis == 1 else (best, idx)
+        top1 = x[pos]
+        x[pos] = -np.inf
+        second = np.max(x, axis=axis)
+        x[pos] = top1
+        return top1 - second
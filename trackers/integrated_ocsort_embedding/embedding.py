@@ -10,17 +10,29 @@ import torchreid
 import numpy as np
 
 from external.adaptors.fastreid_adaptor import FastReID
+from .cachekeys import box_keys, config_digest, file_digest
+from .cachemanager import CACHE
+from .framecache import FrameArrayCache
+
+# ReID model of the MOT17/20 validation, see _get_general_model
+GENERAL_WEIGHTS = "external/weights/osnet_ain_ms_d_c.pth.tar"
 
 
 class EmbeddingComputer:
-    def __init__(self, dataset, test_dataset, grid_off, max_batch=1024):
+    def __init__(self, dataset, test_dataset, grid_off, max_batch=1024, cache_dtype=np.float32):
         self.model = None
         self.dataset = dataset
         self.test_dataset = test_dataset
         self.crop_size = (128, 384)
         os.makedirs("./cache/embeddings/", exist_ok=True)
-        self.cache_path = "./cache/embeddings/{}_embedding.pkl"
-        self.cache = {}
+        # One FrameArrayCache folder per sequence and model config, with one
+        # row per frame and cropped box, see load_cache
+        self.cache_path = "./cache/embeddings/{}_{}"
+        # The former per-sequence cache, {tag: embeddings}, imported on a miss
+        self.legacy_path = "./cache/embeddings/{}_embedding.pkl"
+        self.legacy = None
+        self.cache_dtype = np.dtype(cache_dtype)
+        self.cache = None
         self.cache_name = ""
         self.grid_off = grid_off
         self.max_batch = max_batch
@@ -30,10 +42,44 @@ class EmbeddingComputer:
 
     def load_cache(self, path):
         self.cache_name = path
-        cache_path = self.cache_path.format(path)
-        if os.path.exists(cache_path):
-            with open(cache_path, "rb") as fp:
-                self.cache = pickle.load(fp)
+        weights, crop_size, normalize = self.model_config()
+        # A new folder whenever anything that changes the embeddings changes
+        namespace = config_digest(file_digest(weights), crop_size, normalize, self.grid_off, self.cache_dtype.str)
+        self.cache = CACHE.namespace(f"emb_{namespace}")
+        self.cache.attach(FrameArrayCache(self.cache_path.format(path, namespace), self.cache_dtype))
+        self.legacy = None
+
+    def _legacy_embeddings(self, tag, n):
+        """The n embeddings of tag in the former pickle cache of the sequence, None if it has none."""
+        if self.legacy is None:
+            self.legacy = {}
+            legacy_path = self.legacy_path.format(self.cache_name)
+            if os.path.exists(legacy_path):
+                print(f"Importing the embeddings of {legacy_path}")
+                with open(legacy_path, "rb") as fp:
+                    self.legacy = pickle.load(fp)
+        embs = self.legacy.get(tag)
+        if embs is None or len(embs) != n:
+            return None
+        return np.asarray(embs)
+
+    def model_config(self):
+        """Weights, crop size and input normalization of the ReID model of the dataset."""
+        if self.dataset in ("mot17", "mot20") and not self.test_dataset:
+            return GENERAL_WEIGHTS, (128, 256), True
+        if self.dataset == "mot17":
+            return "external/weights/mot17_sbs_S50.pth", (128, 384), False
+        if self.dataset == "mot20":
+            return "external/weights/mot20_sbs_S50.pth", (128, 384), False
+        if self.dataset == "dance":
+            return "external/weights/dance_sbs_S50.pth", (128, 384), False
+        raise RuntimeError("Need the path for a new ReID model.")
+
+    def _pixel_boxes(self, bbox):
+        """The integer boxes that are actually cropped."""
+        if self.grid_off:
+            return np.round(bbox[:, :4]).astype(np.int32)
+        return bbox[:, :4].astype(int)
 
     def get_horizontal_split_patches(self, image, bbox, tag, idx, viz=False):
         if isinstance(image, np.ndarray):
@@ -97,15 +143,24 @@ class EmbeddingComputer:
         if self.cache_name != tag.split(":")[0]:
             self.load_cache(tag.split(":")[0])
 
-        if tag in self.cache:
-            embs = self.cache[tag]
-            if embs.shape[0] != bbox.shape[0]:
-                raise RuntimeError(
-                    "ERROR: The number of cached embeddings don't match the "
-                    "number of detections.\nWas the detector model changed? Delete cache if so."
-                )
-            return embs
-
+        # Only the boxes not seen in this frame before go to the model
+        frame = ":".join(tag.split(":")[:2])
+        keys = [f"{frame}|{k}" for k in box_keys(self._pixel_boxes(bbox))]
+        values = [self.cache.get(k) for k in keys]
+        missing = np.array([v is None for v in values], dtype=bool)
+        if missing.any():
+            # A frame the former cache has, with as many boxes, is imported as is
+            embs = self._legacy_embeddings(tag, len(bbox)) if missing.all() else None
+            if embs is None:
+                embs = self._compute_embedding(img, bbox[missing], tag)
+            # Kept in the cache dtype, so that the values are the same either way
+            embs = embs.astype(self.cache_dtype)
+            for i, emb in zip(np.flatnonzero(missing), embs):
+                values[i] = emb[np.newaxis]
+                self.cache.put(keys[i], values[i])
+        return np.concatenate(values).astype(np.float32)
+
+    def _compute_embedding(self, img, bbox, tag):
         if self.model is None:
             self.initialize_model()
 
@@ -154,24 +209,12 @@ class EmbeddingComputer:
             embs = embs.reshape(bbox.shape[0], -1, embs.shape[-1])
         embs = embs.cpu().numpy()
 
-        self.cache[tag] = embs
         return embs
 
     def initialize_model(self):
-        if self.dataset == "mot17":
-            if self.test_dataset:
-                path = "external/weights/mot17_sbs_S50.pth"
-            else:
-                return self._get_general_model()
-        elif self.dataset == "mot20":
-            if self.test_dataset:
-                path = "external/weights/mot20_sbs_S50.pth"
-            else:
-                return self._get_general_model()
-        elif self.dataset == "dance":
-            path = "external/weights/dance_sbs_S50.pth"
-        else:
-            raise RuntimeError("Need the path for a new ReID model.")
+        path, _, _ = self.model_config()
+        if path == GENERAL_WEIGHTS:
+            return self._get_general_model()
 
         model = FastReID(path)
         model.eval()
@@ -186,7 +229,7 @@ class EmbeddingComputer:
         validation.
         """
         model = torchreid.models.build_model(name="osnet_ain_x1_0", num_classes=2510, loss="softmax", pretrained=False)
-        sd = torch.load("external/weights/osnet_ain_ms_d_c.pth.tar")["state_dict"]
+        sd = torch.load(GENERAL_WEIGHTS)["state_dict"]
         new_state_dict = OrderedDict()
         for k, v in sd.items():
             name = k[7:]  # remove `module.`
@@ -200,6 +243,5 @@ class EmbeddingComputer:
         self.normalize = True
 
     def dump_cache(self):
-        if self.cache_name:
-            with open(self.cache_path.format(self.cache_name), "wb") as fp:
-                pickle.dump(self.cache, fp)
+        # Single flush point of all the caches
+        CACHE.flush()
@@ -0,0 +1,209 @@
+"""
+    Append-only on-disk cache of per-frame arrays.
+
+    A folder holds the rows of all the frames of a sequence (e.g. one
+    embedding per detection) back to back in rows.bin, which is memory
+    mapped, and an index.txt of one "key<TAB>offset<TAB>count" line per
+    frame. meta.json records the dtype and the shape of a row. Adding a
+    frame appends to both files, nothing is ever rewritten, and reading a
+    frame only touches its rows.
+
+    The two files are a journal: the rows are synced to disk before the
+    index lines that point to them, so a crash at any point loses at most
+    the last append, whose leftovers are dropped by the next one. Rows that
+    are no longer indexed (a key appended again) are reclaimed by compact(),
+    run when the folder is opened with too many of them.
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+
+# Bytes of rows copied at once by compact(), the cache can outgrow the RAM
+COMPACT_CHUNK = 64 << 20
+
+
+class FrameArrayCache(object):
+    def __init__(self, folder, dtype=np.float32, row_shape=None, compact_ratio=0.25):
+        """
+        dtype and row_shape are read back from an existing folder, else
+        row_shape is set by the first append.
+        compact_ratio: fraction of dead rows or index lines above which the
+            folder is compacted when opened.
+        """
+        _recover(folder)
+        self.folder = folder
+        self.rows_path = os.path.join(folder, "rows.bin")
+        self.index_path = os.path.join(folder, "index.txt")
+        self.meta_path = os.path.join(folder, "meta.json")
+        self.dtype = np.dtype(dtype)
+        self.row_shape = None if row_shape is None else tuple(row_shape)
+        self.index = {}
+        self.n_rows = 0
+        # Bytes and number of complete lines in index.txt
+        self._index_size = 0
+        self._index_lines = 0
+        self._map = None
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as fp:
+                meta = json.load(fp)
+            self.dtype = np.dtype(meta["dtype"])
+            self.row_shape = tuple(meta["row_shape"])
+            self._load_index()
+            dead_rows = self.n_rows - self.live_rows()
+            dead_lines = self._index_lines - len(self.index)
+            if dead_rows > compact_ratio * self.n_rows or dead_lines > compact_ratio * self._index_lines:
+                self.compact()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "rb") as fp:
+            for line in fp:
+                # A line cut by a crash is dropped at the next append, so are its rows
+                if not line.endswith(b"\n"):
+                    break
+                key, offset, count = line.decode().rstrip("\n").split("\t")
+                offset, count = int(offset), int(count)
+                self.index[key] = (offset, count)
+                self.n_rows = max(self.n_rows, offset + count)
+                self._index_size += len(line)
+                self._index_lines += 1
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def live_rows(self):
+        return sum(count for _, count in self.index.values())
+
+    @property
+    def row_size(self):
+        return int(np.prod(self.row_shape, dtype=int)) * self.dtype.itemsize
+
+    def get(self, key):
+        """The (count,) + row_shape rows of key, a copy in the stored dtype."""
+        offset, count = self.index[key]
+        if count == 0:
+            return np.empty((0,) + self.row_shape, dtype=self.dtype)
+        if self._map is None or self._map.shape[0] < offset + count:
+            # The file grew since it was mapped
+            self._map = np.memmap(self.rows_path, dtype=self.dtype, mode="r").reshape((-1,) + self.row_shape)
+        return np.array(self._map[offset : offset + count])
+
+    def append(self, key, rows):
+        """Adds the rows of key, they are stored in the cache dtype."""
+        self._write([key], [len(rows)], rows)
+
+    def extend(self, keys, values):
+        """Adds the rows values[i] of each keys[i] in a single write."""
+        if len(keys) > 0:
+            self._write(keys, [len(v) for v in values], np.concatenate(values))
+
+    def _write(self, keys, counts, rows):
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        if self.row_shape is None:
+            self.row_shape = rows.shape[1:]
+        elif rows.shape[1:] != self.row_shape:
+            raise RuntimeError(f"Rows of shape {rows.shape[1:]} in a cache of {self.row_shape} in {self.folder}")
+        if not os.path.exists(self.meta_path):
+            os.makedirs(self.folder, exist_ok=True)
+            # Written aside and renamed, a crash never leaves a partial meta.json
+            tmp = self.meta_path + ".tmp"
+            with open(tmp, "w") as fp:
+                json.dump({"dtype": self.dtype.str, "row_shape": list(self.row_shape)}, fp)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(tmp, self.meta_path)
+
+        with open(self.rows_path, "ab") as fp:
+            # Rows past the indexed ones are leftovers of an interrupted append
+            fp.truncate(self.n_rows * self.row_size)
+            fp.write(rows.tobytes())
+            # On disk before any index line points to them
+            fp.flush()
+            os.fsync(fp.fileno())
+        lines = []
+        offset = self.n_rows
+        for key, count in zip(keys, counts):
+            lines.append(f"{key}\t{offset}\t{count}\n")
+            self.index[key] = (offset, count)
+            offset += count
+        data = "".join(lines).encode()
+        with open(self.index_path, "ab") as fp:
+            fp.truncate(self._index_size)
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        self._index_size += len(data)
+        self._index_lines += len(lines)
+        self.n_rows = offset
+
+    def compact(self):
+        """
+        Rewrites the indexed rows in frame order without the dead ones, about
+        COMPACT_CHUNK bytes at a time. The new folder is built aside and
+        swapped in, see _recover.
+        """
+        tmp = self.folder + ".tmp"
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        store = FrameArrayCache(tmp, self.dtype, self.row_shape)
+        chunk, size = [], 0
+        for key in sorted(self.index, key=_frame_order):
+            chunk.append(key)
+            size += self.index[key][1] * self.row_size
+            if size >= COMPACT_CHUNK:
+                store.extend(chunk, [self.get(k) for k in chunk])
+                chunk, size = [], 0
+        store.extend(chunk, [self.get(k) for k in chunk])
+        os.makedirs(tmp, exist_ok=True)
+        os.rename(self.folder, self.folder + ".old")
+        os.rename(tmp, self.folder)
+        shutil.rmtree(self.folder + ".old")
+        self.index = store.index
+        self.n_rows = store.n_rows
+        self._index_size = store._index_size
+        self._index_lines = store._index_lines
+        self._map = None
+
+
+def _recover(folder):
+    # A compaction interrupted between its two renames leaves only folder.old,
+    # one interrupted after them leaves both
+    old = folder + ".old"
+    if os.path.exists(old):
+        if os.path.exists(folder):
+            shutil.rmtree(old)
+        else:
+            os.rename(old, folder)
+
+
+def convert_pickle(cache, folder, dtype=np.float32):
+    """
+    Writes a {key: array} dict (the former pickled caches) to a
+    FrameArrayCache. It is built aside and renamed, so that an interrupted
+    conversion leaves no partial folder.
+    """
+    tmp = folder + ".tmp"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    store = FrameArrayCache(tmp, dtype)
+    for key in sorted(cache, key=_frame_order):
+        store.append(key, np.asarray(cache[key]))
+    os.makedirs(tmp, exist_ok=True)
+    os.rename(tmp, folder)
+    return FrameArrayCache(folder, dtype)
+
+
+def _frame_order(key):
+    # "seq:frame" tags in frame order
+    parts = key.split(":")
+    return (parts[0], int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else -1, key)
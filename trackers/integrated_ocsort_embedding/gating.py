@@ -0,0 +1,95 @@
+"""
+    Spatial gating for the association.
+
+    Most detection/track pairs of a crowded frame do not overlap at all, so
+    they can never be matched above the IoU threshold. overlap_pairs finds
+    the overlapping pairs with a sort-and-sweep over the x axis instead of
+    testing all N x M of them, so that the association costs only have to be
+    computed (and the assignment solved) for these pairs.
+"""
+import numpy as np
+
+
+def overlap_pairs(bboxes1, bboxes2):
+    """
+    Pairs of [x1,y1,x2,y2] boxes with a non-empty intersection, as two index
+    arrays into bboxes1 and bboxes2, sorted by the first then the second.
+
+    bboxes2 is sorted by x1, every box of bboxes1 sweeps the ones starting
+    between its x1 minus the widest box of bboxes2 and its x2, then the
+    candidates are checked on both axes.
+    """
+    n, m = len(bboxes1), len(bboxes2)
+    if n == 0 or m == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+
+    order = np.argsort(bboxes2[:, 0], kind="stable")
+    x1 = bboxes2[order, 0]
+    max_w = np.max(bboxes2[:, 2] - bboxes2[:, 0])
+    lo = np.searchsorted(x1, bboxes1[:, 0] - max_w, side="left")
+    hi = np.searchsorted(x1, bboxes1[:, 2], side="left")
+    counts = np.maximum(hi - lo, 0)
+
+    # Enumerate the candidate ranges without a Python loop
+    idx1 = np.repeat(np.arange(n), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    idx2 = order[np.repeat(lo, counts) + offsets]
+
+    b1, b2 = bboxes1[idx1], bboxes2[idx2]
+    overlap = (
+        (np.minimum(b1[:, 2], b2[:, 2]) > np.maximum(b1[:, 0], b2[:, 0]))
+        & (np.minimum(b1[:, 3], b2[:, 3]) > np.maximum(b1[:, 1], b2[:, 1]))
+    )
+    idx1, idx2 = idx1[overlap], idx2[overlap]
+    sort = np.lexsort((idx2, idx1))
+    return idx1[sort], idx2[sort]
+
+
+def iou_pairs(bboxes1, bboxes2):
+    """IoU of the row-aligned pairs of boxes, same arithmetic as iou_batch."""
+    xx1 = np.maximum(bboxes1[:, 0], bboxes2[:, 0])
+    yy1 = np.maximum(bboxes1[:, 1], bboxes2[:, 1])
+    xx2 = np.minimum(bboxes1[:, 2], bboxes2[:, 2])
+    yy2 = np.minimum(bboxes1[:, 3], bboxes2[:, 3])
+    w = np.maximum(0.0, xx2 - xx1)
+    h = np.maximum(0.0, yy2 - yy1)
+    wh = w * h
+    o = wh / (
+        (bboxes1[:, 2] - bboxes1[:, 0]) * (bboxes1[:, 3] - bboxes1[:, 1])
+        + (bboxes2[:, 2] - bboxes2[:, 0]) * (bboxes2[:, 3] - bboxes2[:, 1])
+        - wh
+    )
+    return o
+
+
+def sparse_linear_assignment(cost, rows, cols, shape):
+    """
+    Assignment restricted to the given (rows[k], cols[k]) entries with costs
+    cost[k], as many pairs as possible and then of minimum total cost, like
+    linear_assignment on a dense matrix where the other entries are
+    forbidden. Returns the (k, 2) matched [row, col].
+
+    Solved as a perfect matching on the graph extended with one "unmatched"
+    node per row and column (each row is linked to its own, and the nodes of
+    a candidate pair to each other), so a solution always exists.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+    n, m = shape
+    k = len(cost)
+    if k == 0:
+        return np.empty((0, 2), dtype=int)
+
+    # Strictly positive weights, zeros would be missing edges. Leaving a row
+    # or column unmatched costs more than any change of the total cost.
+    shift = 1.0 - cost.min()
+    unmatched = shift + (cost.max() - cost.min() + 1.0) * (min(n, m) + 1)
+    weights = np.concatenate((cost + shift, np.full(k, shift), np.full(n + m, unmatched)))
+    u = np.concatenate((rows, n + cols, np.arange(n), n + np.arange(m)))
+    v = np.concatenate((cols, m + rows, m + np.arange(n), np.arange(m)))
+    graph = coo_matrix((weights, (u, v)), shape=(n + m, n + m)).tocsr()
+
+    u, v = min_weight_full_bipartite_matching(graph)
+    matched = (u < n) & (v < m)
+    return np.stack((u[matched], v[matched]), axis=1)
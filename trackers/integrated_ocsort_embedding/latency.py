@@ -0,0 +1,115 @@
+"""
+    Per-frame latency budget of the tracker.
+
+    Most of the time of OCSort.update goes to the ReID model, proportionally
+    to the number of detection crops that are embedded. LatencyController
+    keeps moving averages of the ReID time per crop and of the rest of the
+    update, and picks for each frame the smallest degradation that fits
+    the frame time of target_fps:
+
+        0 FULL     the Fast-Deep-OC-SORT gate as configured
+        1 LOOSE    looser occlusion / aspect ratio gates, more embeddings reused
+        2 CAPPED   only the most ambiguous detections are embedded before the
+                   association, the others have no appearance cost
+        3 IOU_ONLY no appearance cost at all, association on IoU + VDC
+
+    At levels 2 and 3 the detections left without an embedding that start a
+    new track are embedded after the association.
+"""
+import time
+
+import numpy as np
+
+FULL, LOOSE, CAPPED, IOU_ONLY = 0, 1, 2, 3
+LEVEL_NAMES = ("full", "loose", "capped", "iou_only")
+
+
+class LatencyController(object):
+    def __init__(self, target_fps=None, occlusion_step=0.1, aspect_step=0.1, momentum=0.8):
+        """
+        target_fps: None disables the controller (always FULL).
+        occlusion_step, aspect_step: how much LOOSE raises the occlusion
+            threshold and lowers the aspect ratio threshold of the gate.
+        momentum: weight of the history in the moving averages.
+        """
+        self.frame_time = None if target_fps is None else 1.0 / target_fps
+        self.occlusion_step = occlusion_step
+        self.aspect_step = aspect_step
+        self.momentum = momentum
+        self.crop_time = None
+        self.other_time = None
+        self.level = FULL
+        # Number of frames at each level
+        self.counts = np.zeros(len(LEVEL_NAMES), dtype=int)
+        self._start = None
+        self._reid = 0.0
+
+    def _average(self, old, new):
+        return new if old is None else self.momentum * old + (1 - self.momentum) * new
+
+    def start_frame(self):
+        self._start = time.perf_counter()
+        self._reid = 0.0
+
+    def end_frame(self):
+        total = time.perf_counter() - self._start
+        self.other_time = self._average(self.other_time, total - self._reid)
+        self.counts[self.level] += 1
+
+    def embed(self, embedder, img, bboxes, tag):
+        """embedder.compute_embedding, timed."""
+        start = time.perf_counter()
+        embs = embedder.compute_embedding(img, bboxes, tag)
+        elapsed = time.perf_counter() - start
+        self._reid += elapsed
+        self.crop_time = self._average(self.crop_time, elapsed / len(bboxes))
+        return embs
+
+    def crop_budget(self):
+        """Number of crops that can be embedded this frame, None for no limit."""
+        if self.frame_time is None or self.crop_time is None or self.other_time is None:
+            return None
+        return max(int((self.frame_time - self.other_time) / self.crop_time), 0)
+
+    def loosen(self, occlusion_threshold, aspect_ratio_threshold):
+        """The gate thresholds of the LOOSE level."""
+        return occlusion_threshold + self.occlusion_step, aspect_ratio_threshold - self.aspect_step
+
+    def choose(self, n_full, n_loose):
+        """
+        Sets and returns the level of the frame given the number of crops
+        to embed with the FULL and the LOOSE gates.
+        """
+        budget = self.crop_budget()
+        if budget is None or n_full <= budget:
+            self.level = FULL
+        elif n_loose <= budget:
+            self.level = LOOSE
+        elif budget > 0:
+            self.level = CAPPED
+        else:
+            self.level = IOU_ONLY
+        return self.level
+
+    @staticmethod
+    def prioritize(ious, candidates, occlusion_threshold, budget):
+        """
+        Mask of the detections without candidate to embed within budget, the
+        most ambiguous first: most tracks above occlusion_threshold, then
+        highest IoU.
+        """
+        need = np.flatnonzero(candidates == -1)
+        if ious.shape[1] == 0:
+            overlaps = np.zeros(len(need))
+            best = np.zeros(len(need))
+        else:
+            overlaps = (ious[need] > occlusion_threshold).sum(axis=1)
+            best = ious[need].max(axis=1)
+        order = np.lexsort((-best, -overlaps))
+        embed = np.zeros(len(candidates), dtype=bool)
+        embed[need[order[:budget]]] = True
+        return embed
+
+    def summary(self):
+        total = max(self.counts.sum(), 1)
+        return ", ".join(f"{name} {c / total:.1%}" for name, c in zip(LEVEL_NAMES, self.counts))
@@ -13,7 +13,13 @@ import torchvision
 import numpy as np
 from .association import *
 from .embedding import EmbeddingComputer
-from .cmc import CMCComputer
+from .cmc import CMCComputer, CMCWorker
+from .assignment import get_solver
+from .costs import CostBuilder
+from .reuse import EmbeddingReuse
+from .latency import CAPPED, FULL, IOU_ONLY, LOOSE, LatencyController
+from .visibility import CropSuppression
+from .trackstore import TrackStore
 from .iou import aiou
 
 def xyxy2tlwh(x):
@@ -398,9 +404,22 @@ class OCSort(object):
         aw_param=0.5,
         embedding_off=False,
         cmc_off=False,
+        cmc_method="file",
+        cmc_async=False,
         aw_off=False,
         new_kf_off=False,
         grid_off=False,
+        approx_gating=False,
+        decompose_lap=False,
+        lap_solver="auto",
+        lap_dump=None,
+        cost_dtype="float64",
+        reid_budget=0,
+        reid_adaptive=False,
+        target_fps=None,
+        lazy_embeddings=False,
+        min_visibility=0.0,
+        emb_cache_dtype="float32",
         occ_thresh=0.2,
         asp_thresh=0.65,
         ang_thresh=45,
@@ -412,7 +431,7 @@ class OCSort(object):
         self.max_age = max_age
         self.min_hits = min_hits
         self.iou_threshold = iou_threshold
-        self.trackers = []
+        self.trackers = TrackStore(delta_t=delta_t, new_kf=not new_kf_off)
         self.frame_count = 0
         self.det_thresh = det_thresh
         self.delta_t = delta_t
@@ -421,21 +440,96 @@ class OCSort(object):
         self.w_association_emb = w_association_emb
         self.alpha_fixed_emb = alpha_fixed_emb
         self.aw_param = aw_param
-        KalmanBoxTracker.count = 0
 
-        self.embedder = EmbeddingComputer(kwargs["args"].dataset, kwargs["args"].test_dataset, grid_off)
-        self.cmc = CMCComputer()
+        self.embedder = EmbeddingComputer(
+            kwargs["args"].dataset, kwargs["args"].test_dataset, grid_off, cache_dtype=emb_cache_dtype
+        )
+        self.cmc = CMCComputer(method=cmc_method)
+        # Background CMC started by start_cmc, None to compute it in update
+        self.cmc_worker = CMCWorker(self.cmc) if cmc_async else None
         self.embedding_off = embedding_off
         self.cmc_off = cmc_off
         self.aw_off = aw_off
         self.new_kf_off = new_kf_off
         self.grid_off = grid_off
+        # Only score and solve the overlapping detection/track pairs, an
+        # approximation of the dense association, see associate_gated_approx
+        if approx_gating and (lap_solver != "auto" or decompose_lap):
+            raise ValueError(
+                "approx_gating solves its own sparse assignment, it takes neither lap_solver nor decompose_lap"
+            )
+        self.approx_gating = approx_gating
+        # Solve the assignment per connected component of the IoU graph
+        self.decompose_lap = decompose_lap
+        # Linear assignment backend, see assignment.LAP_SOLVERS
+        self.lap_solver = get_solver(lap_solver, lap_dump)
+        # First round costs built in reused buffers, None for the reference code
+        self.cost_builder = None if cost_dtype is None else CostBuilder(cost_dtype)
+        # How long a track can lend its embedding to the detections
+        self.embedding_reuse = EmbeddingReuse(reid_budget, reid_adaptive)
+        # Degrades the embedding work to stay within target_fps, see latency.py
+        self.latency = LatencyController(target_fps)
+        self.degradation_level = FULL
+        # Only embed the detections whose association is ambiguous without appearance
+        self.lazy_embeddings = lazy_embeddings
+        self.lazy_builder = self.cost_builder if self.cost_builder is not None else CostBuilder(np.float64)
+        # Detections hidden by the ones in front of them are not embedded
+        self.crop_suppression = CropSuppression(min_visibility)
 
         self.occlusion_threshold = occ_thresh
         self.aspect_ratio_threshold = asp_thresh
         # degrees to radians
         self.angle_threshold = ang_thresh * np.pi / 180
 
+    def _secure_candidates(
+        self, dets, context, k_observations, velocities, occlusion_threshold, aspect_ratio_threshold
+    ):
+        """
+        Fast-Deep-OC-SORT gate: for each detection the track whose embedding
+        it can reuse, -1 for none.
+        """
+        ious, alphas = context.iou, context.alpha
+        # if there is ony one entry which is greater than occlusion_threshold in a row,
+        # then the maximum value in this row is the candidate
+        iou_secure = (ious > occlusion_threshold).sum(axis=1) == 1
+        candidates = np.argmax(ious, axis=1)
+        candidates[iou_secure == False] = -1
+
+        # select the columns of the candidate indices
+        candidate_alphas = alphas[np.arange(len(ious)), candidates]
+        asp_secure = (candidate_alphas > aspect_ratio_threshold)
+        candidates[asp_secure == False] = -1
+
+        # find the difference of the centers of dets and k_observations[np.arange(len(ious)), candidates]
+        Y, X = direction_speed(dets, k_observations[candidates])
+        inertia_Y, inertia_X = velocities[candidates][:, 0], velocities[candidates][:, 1]
+        diff_angle_cos = inertia_X * X + inertia_Y * Y
+        diff_angle_cos = np.clip(diff_angle_cos, a_min=-1, a_max=1)
+        diff_angle = np.arccos(diff_angle_cos)
+
+        valid_mask = np.ones(k_observations[candidates].shape[0])
+        valid_mask[np.where(k_observations[candidates][:, 4] < 0)] = 0
+
+        angle_secure = diff_angle > np.pi - self.angle_threshold
+
+        candidates[angle_secure == False] = -1
+        candidates[valid_mask == 0] = -1
+        return candidates
+
+    def start_cmc(self, img_numpy, tag):
+        """
+        Starts the CMC of the frame in the background, before its detections
+        are known. The live methods mask the last observed boxes of the
+        tracks instead, the file method ignores them.
+        """
+        if self.cmc_off or self.cmc_worker is None:
+            return
+        bbox = np.empty((0, 4))
+        if self.cmc.needs_frame:
+            last_obs = self.trackers.last_obs
+            bbox = last_obs[last_obs.sum(axis=1) > 0, :4]
+        self.cmc_worker.submit(img_numpy, bbox, tag)
+
     def update(self, output_results, img_tensor, img_numpy, tag, cv2_frame=None):
         """
         Params:
@@ -446,6 +540,7 @@ class OCSort(object):
         """
         if output_results is None:
             return np.empty((0, 5))
+        self.latency.start_frame()
         if not isinstance(output_results, np.ndarray):
             output_results = output_results.cpu().numpy()
         self.frame_count += 1
@@ -466,9 +561,11 @@ class OCSort(object):
 
         # CMC
         if not self.cmc_off:
-            transform = self.cmc.compute_affine(img_numpy, dets[:, :4], tag)
-            for trk in self.trackers:
-                trk.apply_affine_correction(transform)
+            if self.cmc_worker is not None:
+                transform = self.cmc_worker.result(img_numpy, dets[:, :4], tag)
+            else:
+                transform = self.cmc.compute_affine(img_numpy, dets[:, :4], tag)
+            self.trackers.apply_affine_correction(transform)
 
         trust = (dets[:, 4] - self.det_thresh) / (1 - self.det_thresh)
         af = self.alpha_fixed_emb
@@ -476,77 +573,115 @@ class OCSort(object):
         dets_alpha = af + (1 - af) * (1 - trust)
 
         # get predicted locations from existing trackers.
-        trks = np.zeros((len(self.trackers), 5))
-        trk_embs = []
-        to_del = []
-        ret = []
-        for t, trk in enumerate(trks):
-            pos = self.trackers[t].predict()[0]
-            trk[:] = [pos[0], pos[1], pos[2], pos[3], 0]
-            if np.any(np.isnan(pos)):
-                to_del.append(t)
-            else:
-                trk_embs.append(self.trackers[t].get_emb())
-        trks = np.ma.compress_rows(np.ma.masked_invalid(trks))
+        pos = self.trackers.predict()
+        valid = ~np.any(np.isnan(pos), axis=1)
+        self.trackers.keep(valid)
+        trks = np.concatenate((pos[valid], np.zeros((len(self.trackers), 1))), axis=1)
         # Shape = (num_trackers, 3, 512) if grid
-        trk_embs = np.array(trk_embs)
-        for t in reversed(to_del):
-            self.trackers.pop(t)
+        trk_embs = self.trackers.emb.copy()
 
-        velocities = np.array([trk.velocity if trk.velocity is not None else np.array((0, 0)) for trk in self.trackers])
-        last_boxes = np.array([trk.last_observation for trk in self.trackers])
-        k_observations = np.array([k_previous_obs(trk.observations, trk.age, self.delta_t) for trk in self.trackers])
-        tracklet_bboxes = np.array([trk.get_state()[0] for trk in self.trackers])
+        velocities = self.trackers.velocity.copy()
+        last_boxes = self.trackers.last_obs.copy()
+        k_observations = self.trackers.k_previous_obs()
+        tracklet_bboxes = trks[:, :4]
 
         dets_embs = np.ones((dets.shape[0], 512))
 
         dets_embs = np.ones((dets.shape[0], 512))
-        to_extract = dets
+        # IoU of the detections and the predicted boxes, shared with the first
+        # round, only computed for the overlapping pairs when gating
+        context = AssociationContext(dets, trks, sparse=self.approx_gating)
+        crowd = EmbeddingReuse.crowding(context.iou)
+        candidates = np.full(len(dets), -1)
         if len(trks) > 0 and len(dets) > 0:
-            ious, alphas = aiou_batch(dets, trks)
-            # if there is ony one entry which is greater than occlusion_threshold in a row,
-            # then the maximum value in this row is the candidate
-            iou_secure = (ious > self.occlusion_threshold).sum(axis=1) == 1
-            candidates = np.argmax(ious, axis=1)
-            candidates[iou_secure == False] = -1
-
-            # select the columns of the candidate indices
-            candidate_alphas = alphas[np.arange(len(ious)), candidates]
-            asp_secure = (candidate_alphas > self.aspect_ratio_threshold)
-            candidates[asp_secure == False] = -1
-
-            # find the difference of the centers of dets and k_observations[np.arange(len(ious)), candidates]
-            Y, X = direction_speed(dets, k_observations[candidates])
-            inertia_Y, inertia_X = velocities[candidates][:, 0], velocities[candidates][:, 1]
-            diff_angle_cos = inertia_X * X + inertia_Y * Y
-            diff_angle_cos = np.clip(diff_angle_cos, a_min=-1, a_max=1)
-            diff_angle = np.arccos(diff_angle_cos)
-
-            valid_mask = np.ones(k_observations[candidates].shape[0])
-            valid_mask[np.where(k_observations[candidates][:, 4] < 0)] = 0
-
-            angle_secure = diff_angle > np.pi - self.angle_threshold
-
-            candidates[angle_secure == False] = -1
-            candidates[valid_mask == 0] = -1
-
-            to_extract = dets[candidates == -1]
+            candidates = self._secure_candidates(
+                dets, context, k_observations, velocities, self.occlusion_threshold, self.aspect_ratio_threshold
+            )
+            candidates = self.embedding_reuse.filter(self.trackers, dets, candidates, crowd, context.iou)
+
+        # Degrade the embedding work if the frame would miss its deadline
+        embed = candidates == -1
+        level = FULL
+        if self.latency.crop_budget() is not None and len(trks) > 0 and len(dets) > 0:
+            loose = self._secure_candidates(
+                dets,
+                context,
+                k_observations,
+                velocities,
+                *self.latency.loosen(self.occlusion_threshold, self.aspect_ratio_threshold),
+            )
+            loose = self.embedding_reuse.filter(self.trackers, dets, loose, crowd, context.iou)
+            level = self.latency.choose(embed.sum(), (loose == -1).sum())
+            if level >= LOOSE:
+                candidates = loose
+                embed = candidates == -1
+            if level == CAPPED:
+                embed = self.latency.prioritize(
+                    context.iou, candidates, self.occlusion_threshold, self.latency.crop_budget()
+                )
+            elif level == IOU_ONLY:
+                embed[:] = False
+        self.latency.level = level
+        self.degradation_level = level
+
+        if self.lazy_embeddings and len(trks) > 0 and len(dets) > 0 and embed.any():
+            score = -self.lazy_builder.cost(
+                context.iou,
+                dets,
+                None,
+                None,
+                velocities,
+                k_observations,
+                self.inertia,
+                self.w_association_emb,
+                True,
+                self.aw_param,
+                True,
+                self.grid_off,
+            )
+            lazy = embed & ~ambiguous_detections(context.iou, score, self.iou_threshold)
+            # The unambiguous detections borrow the embedding of their only
+            # candidate as in the gate, the others are embedded only if they
+            # start a new track
+            best = np.argmax(context.iou, axis=1)
+            borrow = lazy & (context.iou[np.arange(len(dets)), best] > self.iou_threshold)
+            candidates[borrow] = best[borrow]
+            embed &= ~lazy
+
+        occluded, visibility = self.crop_suppression.suppress(dets, embed)
+        if occluded.any():
+            # They keep the embedding of the track they overlap the most, and
+            # update it with a weight reduced by their visibility
+            embed &= ~occluded
+            if len(trks) > 0:
+                best = np.argmax(context.iou, axis=1)
+                borrow = occluded & (context.iou[np.arange(len(dets)), best] > self.iou_threshold)
+                candidates[borrow] = best[borrow]
+            dets_alpha[occluded] = 1 - (1 - dets_alpha[occluded]) * visibility[occluded]
+
+        if (candidates != -1).any():
             dets_embs[candidates != -1] = trk_embs[candidates[candidates != -1]]
-
-            if cv2_frame is not None:
-                feature_dets = dets[candidates != -1]
-                non_feature_dets = dets[candidates == -1]
-                for i, det in enumerate(feature_dets):
-                    cv2.rectangle(cv2_frame, (int(det[0]), int(det[1])), (int(det[2]), int(det[3])), (0, 255, 255), 1)
-                for det in non_feature_dets:
-                    cv2.rectangle(cv2_frame, (int(det[0]), int(det[1])), (int(det[2]), int(det[3])), (255, 0, 0), 1)
-                for trk in tracklet_bboxes:
-                    cv2.rectangle(cv2_frame, (int(trk[0]), int(trk[1])), (int(trk[2]), int(trk[3])), (0, 255, 0), 1)
-
+        to_extract = dets[embed]
+
+        if cv2_frame is not None and len(trks) > 0 and len(dets) > 0:
+            feature_dets = dets[candidates != -1]
+            non_feature_dets = dets[candidates == -1]
+            for i, det in enumerate(feature_dets):
+                cv2.rectangle(cv2_frame, (int(det[0]), int(det[1])), (int(det[2]), int(det[3])), (0, 255, 255), 1)
+            for det in non_feature_dets:
+                cv2.rectangle(cv2_frame, (int(det[0]), int(det[1])), (int(det[2]), int(det[3])), (255, 0, 0), 1)
+            for trk in tracklet_bboxes:
+                cv2.rectangle(cv2_frame, (int(trk[0]), int(trk[1])), (int(trk[2]), int(trk[3])), (0, 255, 0), 1)
+
+        # No appearance cost for the detections left without embedding
+        pending = (candidates == -1) & ~embed
+        dets_embs[pending] = 0
+        dets_alpha[pending] = -1
+        self.embedding_reuse.record(candidates, pending.sum())
         # dets_embs = self.embedder.compute_embedding(img_numpy, dets[:, :4], tag)
         to_extract = np.array(to_extract)
         if len(to_extract) > 0:
-            extracted_embs = iter(self.embedder.compute_embedding(img_numpy, to_extract[:, :4], tag))
+            extracted_embs = iter(self.latency.embed(self.embedder, img_numpy, to_extract[:, :4], tag))
             for i, emb in enumerate(dets_embs):
                 if np.all(emb == 1):
                     dets_embs[i] = next(extracted_embs)
@@ -555,6 +690,8 @@ class OCSort(object):
         """
             First round of association
         """
+        # The prices of the previous frame are only kept if the solver ran
+        self.lap_solver.prices = None
         matched, unmatched_dets, unmatched_trks = associate(
             dets,
             trks,
@@ -567,12 +704,20 @@ class OCSort(object):
             self.w_association_emb,
             self.aw_off,
             self.aw_param,
-            self.embedding_off,
+            self.embedding_off or level == IOU_ONLY,
             self.grid_off,
+            self.approx_gating,
+            self.decompose_lap,
+            self.lap_solver,
+            self.trackers.lap_price if self.lap_solver.warm_start else None,
+            self.cost_builder,
+            context,
         )
-        for m in matched:
-            self.trackers[m[1]].update(dets[m[0], :])
-            self.trackers[m[1]].update_emb(dets_embs[m[0]], alpha=dets_alpha[m[0]])
+        if self.lap_solver.prices is not None and not self.decompose_lap:
+            self.trackers.lap_price[:] = self.lap_solver.prices
+        self.trackers.update(matched[:, 1], dets[matched[:, 0]])
+        self.trackers.update_emb(matched[:, 1], dets_embs[matched[:, 0]], dets_alpha[matched[:, 0]])
+        self.embedding_reuse.matched(self.trackers, matched[:, 1], matched[:, 0], candidates, dets, crowd)
         """
             Second round of associaton by OCR
         """
@@ -591,51 +736,49 @@ class OCSort(object):
                 get a higher performance especially on MOT17/MOT20 datasets. But we keep it
                 uniform here for simplicity
                 """
-                rematched_indices = linear_assignment(-iou_left)
-
-                to_remove_det_indices = []
-                to_remove_trk_indices = []
-                for m in rematched_indices:
-                    det_ind, trk_ind = unmatched_dets[m[0]], unmatched_trks[m[1]]
-                    if iou_left[m[0], m[1]] < self.iou_threshold:
-                        continue
-                    self.trackers[trk_ind].update(dets[det_ind, :])
-                    self.trackers[trk_ind].update_emb(dets_embs[det_ind], alpha=dets_alpha[det_ind])
-                    to_remove_det_indices.append(det_ind)
-                    to_remove_trk_indices.append(trk_ind)
-                unmatched_dets = np.setdiff1d(unmatched_dets, np.array(to_remove_det_indices))
-                unmatched_trks = np.setdiff1d(unmatched_trks, np.array(to_remove_trk_indices))
-
-        for m in unmatched_trks:
-            self.trackers[m].update(None)
+                if self.decompose_lap:
+                    rematched_indices = component_assignment(
+                        -iou_left, iou_left > self.iou_threshold, self.lap_solver
+                    )
+                else:
+                    rematched_indices = self.lap_solver(-iou_left)
+
+                rematched_ious = iou_left[rematched_indices[:, 0], rematched_indices[:, 1]]
+                rematched_indices = rematched_indices[rematched_ious >= self.iou_threshold]
+                det_inds = unmatched_dets[rematched_indices[:, 0]]
+                trk_inds = unmatched_trks[rematched_indices[:, 1]]
+                self.trackers.update(trk_inds, dets[det_inds])
+                self.trackers.update_emb(trk_inds, dets_embs[det_inds], dets_alpha[det_inds])
+                self.embedding_reuse.matched(self.trackers, trk_inds, det_inds, candidates, dets, crowd)
+                unmatched_dets = np.setdiff1d(unmatched_dets, det_inds)
+                unmatched_trks = np.setdiff1d(unmatched_trks, trk_inds)
+
+        self.trackers.mark_missed(unmatched_trks)
 
         # create and initialise new trackers for unmatched detections
-        for i in unmatched_dets:
-            trk = KalmanBoxTracker(
-                dets[i, :], delta_t=self.delta_t, emb=dets_embs[i], alpha=dets_alpha[i], new_kf=not self.new_kf_off
-            )
-            self.trackers.append(trk)
-        i = len(self.trackers)
-        for trk in reversed(self.trackers):
-            if trk.last_observation.sum() < 0:
-                d = trk.get_state()[0]
-            else:
-                """
-                this is optional to use the recent observation or the kalman filter prediction,
-                we didn't notice significant difference here
-                """
-                d = trk.last_observation[:4]
-            if (trk.time_since_update < 1) and (trk.hit_streak >= self.min_hits or self.frame_count <= self.min_hits):
-                # +1 as MOT benchmark requires positive
-                ret.append(np.concatenate((d, [trk.id + 1])).reshape(1, -1))
-            i -= 1
-            # remove dead tracklet
-            if trk.time_since_update > self.max_age:
-                self.trackers.pop(i)
+        unmatched_dets = np.asarray(unmatched_dets, dtype=int)
+        late = unmatched_dets[pending[unmatched_dets]]
+        if len(late) > 0:
+            # New tracks of the detections that were not embedded before the association
+            self.crop_suppression.saved -= int(occluded[late].sum())
+            self.embedding_reuse.n_reused -= len(late)
+            dets_embs[late] = self.latency.embed(self.embedder, img_numpy, dets[late, :4], tag + ":late")
+        self.trackers.add(dets[unmatched_dets], dets_embs[unmatched_dets])
+        new_rows = np.arange(len(self.trackers) - len(unmatched_dets), len(self.trackers))
+        # The crowding seen later includes the new track itself
+        self.embedding_reuse.refresh(self.trackers, new_rows, dets[unmatched_dets], crowd[unmatched_dets] + 1)
+
+        ret = self.trackers.output(self.min_hits, self.frame_count, self.max_age)
+        self.latency.end_frame()
         if len(ret) > 0:
-            return np.concatenate(ret)
+            return ret
         return np.empty((0, 5))
 
     def dump_cache(self):
         self.cmc.dump_cache()
         self.embedder.dump_cache()
+
+    def close(self):
+        """Stops the CMC thread, at the end of the sequence."""
+        if self.cmc_worker is not None:
+            self.cmc_worker.close()
@@ -0,0 +1,129 @@
+"""
+    Temporal reuse of the track embeddings.
+
+    The Fast-Deep-OC-SORT gate of OCSort.update lends a track's embedding to
+    a detection that securely matches it instead of running the ReID model on
+    the crop. EmbeddingReuse bounds how long a track can keep doing so: after
+    `budget` consecutive reuses, or when the box scale, the aspect ratio or
+    the number of overlapping tracks changed since the track's embedding was
+    last refreshed from a crop, the detection gets a fresh embedding.
+    Within the budget, a track matched on the previous frame keeps lending
+    its embedding to its best overlapping detection even when the gate of
+    the frame rejects the pair, so the streaks actually extend the reuse.
+    It also counts the detections whose crop was skipped.
+"""
+import numpy as np
+
+
+class EmbeddingReuse(object):
+    def __init__(self, budget=0, adaptive=False, motion=0.1, scale_change=0.1, aspect_change=0.1, min_iou=0.5):
+        """
+        budget: maximum number of consecutive reuses per track, 0 for no limit
+            and no forced refresh (the gate alone decides).
+        adaptive: shrink the budget of the fast tracks, it is halved at a
+            speed of `motion` box heights per frame.
+        scale_change, aspect_change: relative change of sqrt(w * h) and w / h
+            since the last refresh that forces a new one.
+        min_iou: IoU above which a detection and a track that are each other's
+            best match keep reusing the embedding past the gate.
+        """
+        self.budget = budget
+        self.adaptive = adaptive
+        self.motion = motion
+        self.scale_change = scale_change
+        self.aspect_change = aspect_change
+        self.min_iou = min_iou
+        self.n_dets = 0
+        self.n_reused = 0
+
+    @property
+    def skip_rate(self):
+        """Fraction of the detections that reused a track embedding."""
+        return self.n_reused / max(self.n_dets, 1)
+
+    @staticmethod
+    def crowding(ious):
+        """Number of tracks overlapping each detection, from the (dets, tracks) IoU."""
+        return (ious > 0).sum(axis=1)
+
+    def filter(self, store, dets, candidates, crowd, ious=None):
+        """
+        candidates is the track lending its embedding to each detection, -1
+        for none. With a budget, the detections left without one also take
+        their sticky track, see sticky(). Returns the candidates with -1
+        where the track has to be refreshed.
+        """
+        candidates = candidates.copy()
+        if self.budget > 0:
+            if ious is not None:
+                sticky = self.sticky(store, candidates, ious)
+                candidates[sticky != -1] = sticky[sticky != -1]
+            has = np.flatnonzero(candidates != -1)
+            c = candidates[has]
+            w = dets[has, 2] - dets[has, 0]
+            h = dets[has, 3] - dets[has, 1]
+            budget = np.full(len(has), self.budget)
+            if self.adaptive:
+                speed = np.hypot(store.x[c, 4], store.x[c, 5]) / h
+                budget = np.maximum(1, (self.budget / (1 + speed / self.motion)).astype(int))
+            ref = store.emb_ref[c]
+            scale = np.sqrt(w * h / (ref[:, 0] * ref[:, 1]))
+            aspect = (w / h) / (ref[:, 0] / ref[:, 1])
+            refresh = (
+                (store.emb_streak[c] >= budget)
+                | (np.abs(scale - 1) > self.scale_change)
+                | (np.abs(aspect - 1) > self.aspect_change)
+                | (crowd[has] != ref[:, 2])
+            )
+            candidates[has[refresh]] = -1
+        return candidates
+
+    def sticky(self, store, candidates, ious):
+        """
+        For the detections without candidate, the track matched on the
+        previous frame that they overlap the most if they are each other's
+        best match above min_iou and it lends its embedding to no other
+        detection, -1 for none. ious is the (dets, tracks) IoU.
+        """
+        sticky = np.full(len(candidates), -1)
+        if ious.size == 0:
+            return sticky
+        rows = np.arange(len(ious))
+        best = np.argmax(ious, axis=1)
+        keep = (
+            (candidates == -1)
+            & (np.argmax(ious, axis=0)[best] == rows)
+            & (ious[rows, best] > self.min_iou)
+            # predict() already counted the current frame
+            & (store.time_since_update[best] == 1)
+            & ~np.isin(best, candidates)
+        )
+        sticky[keep] = best[keep]
+        return sticky
+
+    def record(self, candidates, skipped=0):
+        """
+        Counts the detections of a frame and the ones that skip the ReID
+        model, the reused ones plus `skipped` others.
+        """
+        self.n_dets += len(candidates)
+        self.n_reused += int((candidates != -1).sum()) + int(skipped)
+
+    def matched(self, store, rows, det_inds, candidates, dets, crowd):
+        """
+        Tracks matched to detections: the ones matched to a reused embedding
+        extend their streak, the others are refreshed from the crop.
+        """
+        rows = np.asarray(rows, dtype=int)
+        det_inds = np.asarray(det_inds, dtype=int)
+        reused = candidates[det_inds] != -1
+        store.emb_streak[rows[reused]] += 1
+        self.refresh(store, rows[~reused], dets[det_inds[~reused]], crowd[det_inds[~reused]])
+
+    @staticmethod
+    def refresh(store, rows, dets, crowd):
+        """Restarts the streak of the rows from the given boxes and crowding."""
+        store.emb_streak[rows] = 0
+        store.emb_ref[rows, 0] = dets[:, 2] - dets[:, 0]
+        store.emb_ref[rows, 1] = dets[:, 3] - dets[:, 1]
+        store.emb_ref[rows, 2] = crowd
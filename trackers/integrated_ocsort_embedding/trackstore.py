@@ -0,0 +1,398 @@
+"""
+    Columnar (structure-of-arrays) storage for the tracks of OCSort.
+
+    Every live track is one row of a set of contiguous NumPy arrays instead of
+    one KalmanBoxTracker object, so that the per-frame bookkeeping (predict,
+    embedding EMA, output assembly, dead track removal) becomes a handful of
+    array operations. The semantics follow KalmanBoxTracker/KalmanFilterNew
+    step by step, including their quirks, so the tracker output is unchanged.
+"""
+import numpy as np
+
+from .batchkalman import BatchKalmanFilter, new_kf_measurement_noise_batch, new_kf_process_noise_batch
+
+
+def bbox_to_z(bboxes, new_kf):
+    """[x1,y1,x2,y2] rows to the measurement space of the filter."""
+    w = bboxes[:, 2] - bboxes[:, 0]
+    h = bboxes[:, 3] - bboxes[:, 1]
+    x = bboxes[:, 0] + w / 2.0
+    y = bboxes[:, 1] + h / 2.0
+    if new_kf:
+        return np.stack((x, y, w, h), axis=1)
+    s = w * h  # scale is just area
+    r = w / (h + 1e-6)
+    return np.stack((x, y, s, r), axis=1)
+
+
+def x_to_bbox(x, new_kf):
+    """State rows to [x1,y1,x2,y2] rows."""
+    if new_kf:
+        w = x[:, 2]
+        h = x[:, 3]
+    else:
+        w = np.sqrt(x[:, 2] * x[:, 3])
+        h = x[:, 2] / w
+    return np.stack((x[:, 0] - w / 2.0, x[:, 1] - h / 2.0, x[:, 0] + w / 2.0, x[:, 1] + h / 2.0), axis=1)
+
+
+class TrackStore(object):
+    """
+    Structure-of-arrays store of the tracks. Row order is the track order
+    used by the association (it is preserved on removal).
+    """
+
+    # Per-row columns, see _shapes for their trailing shape and dtype
+    COLUMNS = (
+        "ids",
+        "last_obs",
+        "last_obs_age",
+        "obs_buf",
+        "obs_age",
+        "velocity",
+        "emb",
+        "age",
+        "hits",
+        "hit_streak",
+        "time_since_update",
+        "time_since_emb_update",
+        "frozen",
+        "lap_price",
+        "emb_streak",
+        "emb_ref",
+    )
+
+    def __init__(self, delta_t=3, new_kf=True, capacity=64):
+        self.delta_t = delta_t
+        self.new_kf = new_kf
+        self.count = 0
+        self.n = 0
+
+        # Means and covariances of all the tracks. For new_kf the process and
+        # measurement uncertainty are computed per track, the default Q, R of
+        # the filter are only used by the ORU re-update.
+        self.kf = BatchKalmanFilter.box_filter(new_kf, capacity=capacity)
+        self.dim_x = self.kf.dim_x
+
+        self._capacity = 0
+        self._emb_shape = None
+        # Previous observations of each row in a ring buffer indexed by
+        # age % obs_size, with the age of each slot (-1 when empty). Only the
+        # observations of the last delta_t steps are ever read or warped, the
+        # most recent one is kept in last_obs and not duplicated here, so
+        # delta_t + 1 slots are enough and the memory per track is constant.
+        self.obs_size = delta_t + 1
+        self._allocate(capacity, (0,))
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def x(self):
+        return self.kf.x
+
+    @property
+    def P(self):
+        return self.kf.P
+
+    def _shapes(self):
+        d = self.dim_x
+        return {
+            "ids": ((), np.int64),
+            "last_obs": ((5,), float),
+            "last_obs_age": ((), np.int64),
+            "obs_buf": ((self.obs_size, 5), float),
+            "obs_age": ((self.obs_size,), np.int64),
+            "velocity": ((2,), float),
+            "emb": (self._emb_shape, float),
+            "age": ((), np.int64),
+            "hits": ((), np.int64),
+            "hit_streak": ((), np.int64),
+            "time_since_update": ((), np.int64),
+            "time_since_emb_update": ((), np.int64),
+            "frozen": ((), bool),
+            # Dual variable of the track in the last association, warm start
+            "lap_price": ((), float),
+            # Consecutive embedding reuses, and w, h, crowding at the last
+            # refresh, see reuse.EmbeddingReuse
+            "emb_streak": ((), np.int64),
+            "emb_ref": ((3,), float),
+        }
+
+    def _allocate(self, capacity, emb_shape):
+        self._emb_shape = emb_shape
+        shapes = self._shapes()
+        for name in self.COLUMNS:
+            shape, dtype = shapes[name]
+            col = np.zeros((capacity,) + shape, dtype=dtype)
+            old = getattr(self, "_" + name, None)
+            if old is not None and self.n > 0:
+                col[: self.n] = old[: self.n]
+            setattr(self, "_" + name, col)
+        self._capacity = capacity
+
+    def __getattr__(self, name):
+        # Live views of the columns, e.g. store.age is the (n,) ages
+        if name in TrackStore.COLUMNS:
+            return self.__dict__["_" + name][: self.__dict__["n"]]
+        raise AttributeError(name)
+
+    def add(self, bboxes, embs):
+        """Create one track per detection row, as KalmanBoxTracker.__init__."""
+        k = bboxes.shape[0]
+        if k == 0:
+            return
+        if self._emb_shape != embs.shape[1:]:
+            # Only happens before the first track is created
+            self._allocate(self._capacity, embs.shape[1:])
+        if self.n + k > self._capacity:
+            self._allocate(max(2 * self._capacity, self.n + k), self._emb_shape)
+
+        rows = slice(self.n, self.n + k)
+        z = bbox_to_z(bboxes, self.new_kf)
+        x = np.zeros((k, self.dim_x))
+        x[:, :4] = z
+        if self.new_kf:
+            P = new_kf_process_noise_batch(z[:, 2], z[:, 3])
+            P[:, :4, :4] *= 4
+            P[:, 4:, 4:] *= 100
+        else:
+            P = np.eye(self.dim_x)
+            P[4:, 4:] *= 1000.0  # give high uncertainty to the unobservable initial velocities
+            P *= 10.0
+            P = np.repeat(P[np.newaxis], k, axis=0)
+
+        self._ids[rows] = np.arange(self.count, self.count + k)
+        self.count += k
+        self.kf.add(x, P)
+        # [-1,-1,-1,-1,-1] is the placeholder for non-observation status
+        self._last_obs[rows] = -1
+        self._last_obs_age[rows] = -1
+        self._obs_age[rows] = -1
+        self._velocity[rows] = 0
+        self._emb[rows] = embs
+        for name in ("age", "hits", "hit_streak", "time_since_update", "time_since_emb_update"):
+            getattr(self, "_" + name)[rows] = 0
+        self._frozen[rows] = False
+        self._lap_price[rows] = 0
+        self._emb_streak[rows] = 0
+        self._emb_ref[rows, 0] = bboxes[:, 2] - bboxes[:, 0]
+        self._emb_ref[rows, 1] = bboxes[:, 3] - bboxes[:, 1]
+        self._emb_ref[rows, 2] = 0
+        self.n += k
+
+    def keep(self, mask):
+        """Drop the rows where mask is False, preserving the order of the others."""
+        if mask.all():
+            return
+        k = int(mask.sum())
+        for name in self.COLUMNS:
+            col = getattr(self, "_" + name)
+            col[:k] = col[: self.n][mask]
+        self.kf.keep(mask)
+        self.n = k
+
+    def predict(self):
+        """
+        Advances all the states and returns the predicted bounding boxes.
+        """
+        x = self.x
+        if self.new_kf:
+            # Don't allow negative bounding boxes
+            x[x[:, 2] + x[:, 6] <= 0, 6] = 0
+            x[x[:, 3] + x[:, 7] <= 0, 7] = 0
+            # Stop velocity, will update in kf during OOS
+            x[self.frozen, 6:8] = 0
+            Q = new_kf_process_noise_batch(x[:, 2], x[:, 3])
+        else:
+            neg = (x[:, 6] + x[:, 2]) <= 0
+            x[neg, 6] *= 0.0
+            Q = None
+        self.kf.predict(Q=Q)
+
+        self.age[:] += 1
+        self.hit_streak[self.time_since_update > 0] = 0
+        self.time_since_update[:] += 1
+        return self.get_state()
+
+    def get_state(self):
+        """Current bounding box estimates, (n, 4)."""
+        return x_to_bbox(self.x, self.new_kf)
+
+    def k_previous_obs(self):
+        """Observation delta_t steps back (or the closest one) for each track."""
+        return self._previous_obs(np.arange(self.n))
+
+    def _previous_obs(self, rows):
+        """
+        The oldest observation of the last delta_t steps (ages age - delta_t
+        to age - 1) of the given rows, else their last observation, which is
+        the [-1,-1,-1,-1,-1] placeholder for the tracks never observed.
+        """
+        age = self.age[rows]
+        last_age = self.last_obs_age[rows]
+        out = self.last_obs[rows].copy()
+        found = np.zeros(len(rows), dtype=bool)
+        for dt in range(self.delta_t, 0, -1):
+            a = age - dt
+            slot = a % self.obs_size
+            is_last = (last_age == a) & (a >= 0)
+            hit = ((self.obs_age[rows, slot] == a) & (a >= 0) | is_last) & ~found
+            if hit.any():
+                out[hit] = np.where(is_last[hit, np.newaxis], out[hit], self.obs_buf[rows[hit], slot[hit]])
+                found |= hit
+        return out
+
+    def update(self, rows, bboxes):
+        """Updates the matched tracks with their observed bboxes."""
+        rows = np.asarray(rows, dtype=int)
+        if len(rows) == 0:
+            return
+        self._observe(rows, bboxes)
+
+        self.frozen[rows] = False
+        self.time_since_update[rows] = 0
+        self.hits[rows] += 1
+        self.hit_streak[rows] += 1
+
+        z = bbox_to_z(bboxes[:, :4], self.new_kf)
+        if self.new_kf:
+            # Uses the state before the ORU re-update
+            R = new_kf_measurement_noise_batch(self.x[rows, 2], self.x[rows, 3])
+        else:
+            R = None
+        self.kf.update(rows, z, R=R)
+
+    def _observe(self, rows, bboxes):
+        moving = self.last_obs[rows].sum(axis=1) >= 0  # no previous observation
+        if moving.any():
+            # Estimate the track speed direction with observations \Delta t steps away
+            previous_box = self._previous_obs(rows[moving])
+            bbox = bboxes[moving]
+            cx1, cy1 = (previous_box[:, 0] + previous_box[:, 2]) / 2.0, (previous_box[:, 1] + previous_box[:, 3]) / 2.0
+            cx2, cy2 = (bbox[:, 0] + bbox[:, 2]) / 2.0, (bbox[:, 1] + bbox[:, 3]) / 2.0
+            speed = np.stack((cy2 - cy1, cx2 - cx1), axis=1)
+            norm = np.sqrt((cy2 - cy1) ** 2 + (cx2 - cx1) ** 2) + 1e-6
+            self.velocity[rows[moving]] = speed / norm[:, np.newaxis]
+
+        # The previous last observation moves to the ring buffer
+        prev = rows[self.last_obs_age[rows] >= 0]
+        slot = self.last_obs_age[prev] % self.obs_size
+        self.obs_buf[prev, slot] = self.last_obs[prev]
+        self.obs_age[prev, slot] = self.last_obs_age[prev]
+        self.last_obs[rows] = bboxes
+        self.last_obs_age[rows] = self.age[rows]
+
+    def mark_missed(self, rows):
+        """Tracks without observation this frame, as KalmanBoxTracker.update(None)."""
+        rows = np.asarray(rows, dtype=int)
+        if len(rows) == 0:
+            return
+        self.frozen[rows] = True
+        self.kf.update(rows, None)
+
+    def update_emb(self, rows, embs, alphas):
+        """EMA update of the track embeddings, alpha == -1 skips the update."""
+        rows = np.asarray(rows, dtype=int)
+        if len(rows) == 0:
+            return
+        alphas = np.asarray(alphas)
+        upd = alphas != -1
+        skip = rows[~upd]
+        self.time_since_emb_update[skip] += 1
+
+        rows, embs, alphas = rows[upd], embs[upd], alphas[upd]
+        a = alphas ** (self.time_since_emb_update[rows] + 1)
+        a = a.reshape((-1,) + (1,) * (embs.ndim - 1))
+        self.time_since_emb_update[rows] = 0
+        emb = a * self.emb[rows] + (1 - a) * embs
+        norm = np.linalg.norm(emb.reshape(emb.shape[0], np.prod(emb.shape[1:], dtype=int)), axis=1)
+        self.emb[rows] = emb / norm.reshape(a.shape)
+
+    def apply_affine_correction(self, affine):
+        m = affine[:, :2]
+        t = affine[:, 2].reshape(2, 1)
+
+        def warp(boxes):
+            # [x1,y1,x2,y2] rows as two points each
+            ps = boxes[..., :4].reshape(boxes.shape[:-1] + (2, 2))
+            return (ps @ m.T + t.T).reshape(boxes.shape[:-1] + (4,))
+
+        # For OCR
+        last_obs = self.last_obs
+        sel = last_obs.sum(axis=1) > 0
+        last_obs[sel, :4] = warp(last_obs[sel])
+
+        # Apply to each box in the range of velocity computation. The most
+        # recent observation is the same box as last_obs in KalmanBoxTracker,
+        # so it is warped a second time when it is in range.
+        window = (self.age - self.delta_t)[:, np.newaxis]
+        sel = (self.last_obs_age >= 0) & (self.last_obs_age >= window[:, 0])
+        last_obs[sel, :4] = warp(last_obs[sel])
+        sel = (self.obs_age >= 0) & (self.obs_age >= window)
+        self.obs_buf[sel, :4] = warp(self.obs_buf[sel])
+
+        self._affine_states(m, t)
+
+    def _affine_states(self, m, t):
+        """
+        Warps the kalman states of all the tracks at once, and the states
+        saved for the ORU of the frozen ones. The batched matmuls run the
+        same products as KalmanFilterNew.apply_affine_correction per track.
+        """
+        kf = self.kf
+        if self.n == 0:
+            return
+        frozen = np.flatnonzero(~kf.observed & kf.has_saved)
+        if self.new_kf:
+            big_m = np.kron(np.eye(4, dtype=float), m)
+            x = big_m @ kf.x[:, :, np.newaxis]
+            x[:, :2] += t
+            kf.x[:] = x[..., 0]
+            kf.P[:] = big_m @ kf.P @ big_m.T
+            # If frozen, also need to update the frozen state for OOS
+            if len(frozen) > 0:
+                sx = big_m @ kf.saved_x[frozen, :, np.newaxis]
+                sx[:, :2] += t
+                kf.saved_x[frozen] = sx[..., 0]
+                kf.saved_P[frozen] = big_m @ kf.saved_P[frozen] @ big_m.T
+                sz = kf.saved_z[frozen, :, np.newaxis]
+                sz[:, :2] = m @ sz[:, :2] + t
+                sz[:, 2:] = m @ sz[:, 2:]
+                kf.saved_z[frozen] = sz[..., 0]
+        else:
+            x = kf.x[:, :, np.newaxis]
+            x[:, :2] = m @ x[:, :2] + t
+            x[:, 4:6] = m @ x[:, 4:6]
+            P = kf.P
+            P[:, :2, :2] = m @ P[:, :2, :2] @ m.T
+            P[:, 4:6, 4:6] = m @ P[:, 4:6, 4:6] @ m.T
+            if len(frozen) > 0:
+                sx = kf.saved_x[frozen, :, np.newaxis]
+                sx[:, :2] = m @ sx[:, :2] + t
+                sx[:, 4:6] = m @ sx[:, 4:6]
+                kf.saved_x[frozen] = sx[..., 0]
+                sP = kf.saved_P[frozen]
+                sP[:, :2, :2] = m @ sP[:, :2, :2] @ m.T
+                sP[:, 4:6, 4:6] = m @ sP[:, 4:6, 4:6] @ m.T
+                kf.saved_P[frozen] = sP
+                sz = kf.saved_z[frozen, :, np.newaxis]
+                sz[:, :2] = m @ sz[:, :2] + t
+                kf.saved_z[frozen] = sz[..., 0]
+
+    def output(self, min_hits, frame_count, max_age):
+        """
+        Assembles the [x1,y1,x2,y2,id] output (in reverse track order, as the
+        per-object implementation) and removes the dead tracks.
+        """
+        last_obs = self.last_obs
+        # The recent observation or the kalman filter prediction, we didn't
+        # notice significant difference here
+        d = np.where((last_obs.sum(axis=1) < 0)[:, np.newaxis], self.get_state(), last_obs[:, :4])
+        tsu = self.time_since_update
+        sel = (tsu < 1) & ((self.hit_streak >= min_hits) | (frame_count <= min_hits))
+        # +1 as MOT benchmark requires positive
+        ret = np.concatenate((d[sel], (self.ids[sel] + 1)[:, np.newaxis]), axis=1)[::-1]
+        # remove dead tracklet
+        self.keep(tsu <= max_age)
+        return ret
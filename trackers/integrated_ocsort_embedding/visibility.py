@@ -0,0 +1,60 @@
+"""
+    Occlusion-aware crop suppression before the ReID model.
+
+    In a ground-level view the box whose bottom edge is lower in the image is
+    closer to the camera, so it hides the part of the boxes behind it that it
+    covers. The visible fraction of each detection is estimated on a grid of
+    sample points inside its box, a point being hidden when it falls in a box
+    with a lower bottom edge. Mostly hidden detections give poor appearance
+    features for the cost of a crop, they are not embedded.
+"""
+import numpy as np
+
+
+def visible_fraction(boxes, samples=8):
+    """
+    Fraction of each [x1,y1,x2,y2] box not covered by the boxes in front of
+    it (larger y2), estimated on samples x samples points per box. (n,)
+    """
+    n = len(boxes)
+    if n == 0:
+        return np.empty(0)
+    # Cell centers in [0, 1]
+    t = (np.arange(samples) + 0.5) / samples
+    tx, ty = np.meshgrid(t, t)
+    px = boxes[:, 0, np.newaxis] + (boxes[:, 2] - boxes[:, 0])[:, np.newaxis] * tx.ravel()
+    py = boxes[:, 1, np.newaxis] + (boxes[:, 3] - boxes[:, 1])[:, np.newaxis] * ty.ravel()
+
+    # front[i, j]: box j is in front of box i
+    front = boxes[np.newaxis, :, 3] > boxes[:, np.newaxis, 3]
+    # (n, samples^2, n): sample point of box i inside box j in front of it
+    hidden = (
+        (px[..., np.newaxis] >= boxes[:, 0])
+        & (px[..., np.newaxis] <= boxes[:, 2])
+        & (py[..., np.newaxis] >= boxes[:, 1])
+        & (py[..., np.newaxis] <= boxes[:, 3])
+        & front[:, np.newaxis]
+    ).any(axis=2)
+    return 1.0 - hidden.mean(axis=1)
+
+
+class CropSuppression(object):
+    """Skips the embedding of the detections less visible than threshold."""
+
+    def __init__(self, threshold=0.0, samples=8):
+        self.threshold = threshold
+        self.samples = samples
+        # Number of crops not sent to the ReID model
+        self.saved = 0
+
+    def suppress(self, dets, embed):
+        """
+        Returns the mask of the detections to embed that are too occluded,
+        and the visible fraction of all the detections.
+        """
+        if self.threshold <= 0 or not embed.any():
+            return np.zeros(len(dets), dtype=bool), np.ones(len(dets))
+        visibility = visible_fraction(dets[:, :4], self.samples)
+        occluded = embed & (visibility < self.threshold)
+        self.saved += int(occluded.sum())
+        return occluded, visibility